@@ -3,6 +3,9 @@ from chromadb.config import Settings
 from typing import List, Dict, Any
 from app.models import KnowledgeChunk
 
+# Hashes per $in lookup; keeps each Chroma query under SQLite's bound-variable limit (999 on older builds)
+SHA256_LOOKUP_BATCH_SIZE = 500
+
 class VectorDatabase:
     def __init__(self, persist_directory: str = "data/vectordb", collection_name: str = "vendor_invoices"):
         """Initialize ChromaDB vector database."""
@@ -421,18 +424,25 @@ class VectorDatabase:
             print(f"Error deleting user data: {e}")
             return False
 
-    def get_indexed_sha256_hashes(self, user_id: str) -> set:
-        """Get all sha256 hashes already indexed for a user."""
+    def filter_existing_sha256(self, user_id: str, candidate_hashes: List[str]) -> set:
+        """Return the subset of candidate sha256 hashes already indexed for a user."""
+        if not candidate_hashes:
+            return set()
+        candidates = list(candidate_hashes)
         try:
-            results = self.collection.get(
-                where={"user_id": user_id},
-                include=["metadatas"]
-            )
             hashes = set()
-            for meta in results.get("metadatas", []):
-                if isinstance(meta, dict) and meta.get("sha256"):
-                    hashes.add(meta["sha256"])
+            for i in range(0, len(candidates), SHA256_LOOKUP_BATCH_SIZE):
+                results = self.collection.get(
+                    where={"$and": [
+                        {"user_id": user_id},
+                        {"sha256": {"$in": candidates[i:i + SHA256_LOOKUP_BATCH_SIZE]}},
+                    ]},
+                    include=["metadatas"]
+                )
+                for meta in results.get("metadatas", []):
+                    if isinstance(meta, dict) and meta.get("sha256"):
+                        hashes.add(meta["sha256"])
             return hashes
         except Exception as e:
-            print(f"Error getting indexed sha256 hashes: {e}")
+            print(f"Error filtering indexed sha256 hashes: {e}")
             return set()
@@ -1,7 +1,7 @@
 import os
 import logging
 import certifi
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, UpdateMany
 from datetime import datetime, timezone
 
 logger = logging.getLogger(__name__)
@@ -9,6 +9,12 @@ logger = logging.getLogger(__name__)
 _client = None
 _db = None
 
+# Compound index backing the "completed but not yet indexed" sync lookup
+UNINDEXED_INDEX = [("userId", ASCENDING), ("ocrStatus", ASCENDING), ("indexed", ASCENDING)]
+
+# Max values per $in filter so large syncs stay well below the 16MB command limit
+IN_BATCH_SIZE = 1000
+
 
 def get_db():
     """Get MongoDB database instance (lazy initialization)."""
@@ -20,66 +26,69 @@ def get_db():
         db_name = os.getenv("MONGO_DB_NAME", "app_database")
         _client = MongoClient(mongo_uri, serverSelectionTimeoutMS=10000, tlsCAFile=certifi.where())
         _db = _client[db_name]
+        _init_indexes()
         logger.info(f"Chat service connected to MongoDB: {db_name}")
     return _db
 
 
+def _init_indexes():
+    """Ensure the index hinted by the sync query exists (shared with OCR service)."""
+    global _db
+    docs = _db["documents"]
+    docs.create_index(UNINDEXED_INDEX)
+
+
 def get_unindexed_documents(user_id: str) -> list:
     """Get documents that completed OCR but not yet indexed."""
     db = get_db()
     docs = db["documents"]
-    return list(docs.find({
+    cursor = docs.find({
         "userId": user_id,
         "ocrStatus": "COMPLETED",
         "indexed": False
     }, {
-        "_id": 1,
+        "_id": 0,
         "driveFileId": 1,
         "vendorName": 1,
         "vendorFolderId": 1,
-        "fileName": 1,
         "sha256": 1,
-    }))
+    }).hint(UNINDEXED_INDEX).batch_size(1000)
+    return list(cursor)
 
 
-def mark_documents_indexed(user_id: str, drive_file_ids: list) -> int:
-    """Mark multiple documents as indexed."""
+def _mark_indexed_in_batches(user_id: str, field: str, values: list) -> int:
+    """Mark documents whose `field` is in `values` as indexed, chunking the $in list."""
+    if not values:
+        return 0
+
     db = get_db()
     docs = db["documents"]
     
     now = datetime.now(timezone.utc)
-    result = docs.update_many(
-        {"userId": user_id, "driveFileId": {"$in": drive_file_ids}},
-        {
-            "$set": {
-                "indexed": True,
-                "indexedAt": now,
-                "updatedAt": now,
-            },
-            "$inc": {"indexVersion": 1}
-        }
-    )
+    update = {
+        "$set": {
+            "indexed": True,
+            "indexedAt": now,
+            "updatedAt": now,
+        },
+        "$inc": {"indexVersion": 1}
+    }
+    operations = [
+        UpdateMany({"userId": user_id, field: {"$in": values[i:i + IN_BATCH_SIZE]}}, update)
+        for i in range(0, len(values), IN_BATCH_SIZE)
+    ]
+    result = docs.bulk_write(operations, ordered=False)
     return result.modified_count
 
 
+def mark_documents_indexed(user_id: str, drive_file_ids: list) -> int:
+    """Mark multiple documents as indexed."""
+    return _mark_indexed_in_batches(user_id, "driveFileId", drive_file_ids)
+
+
 def mark_documents_indexed_by_sha256(user_id: str, sha256_list: list) -> int:
     """Mark documents as indexed by their sha256 hash."""
-    db = get_db()
-    docs = db["documents"]
-    
-    now = datetime.now(timezone.utc)
-    result = docs.update_many(
-        {"userId": user_id, "sha256": {"$in": sha256_list}},
-        {
-            "$set": {
-                "indexed": True,
-                "indexedAt": now,
-                "updatedAt": now,
-            },
-            "$inc": {"indexVersion": 1}
-        }
-    )
-    return result.modified_count
+    return _mark_indexed_in_batches(user_id, "sha256", sha256_list)
 
 
 def reset_user_index(user_id: str) -> int:
@@ -12,10 +12,12 @@ Endpoints:
 from fastapi import APIRouter, HTTPException, Query, Path
 from pydantic import BaseModel
 from typing import Optional
+from collections import defaultdict
 import logging
 from app.core.orchestrator import VendorKnowledgeOrchestrator
 from app.db import get_unindexed_documents, mark_documents_indexed, mark_documents_indexed_by_sha256, get_user_document_stats
 import httpx
+import orjson
 
 router = APIRouter(tags=["Chat Service"])
 logger = logging.getLogger(__name__)
@@ -68,7 +70,7 @@ async def sync_documents(request: SyncRequest):
     unindexed = get_unindexed_documents(user_id)
     
     if not unindexed:
-        return SyncResponse(
+        return SyncResponse.model_construct(
             success=True,
             documentsIndexed=0,
             documentsSkipped=0,
@@ -77,8 +79,9 @@ async def sync_documents(request: SyncRequest):
     
     orchestrator = get_orchestrator()
     
-    # Get already indexed sha256 hashes from vector DB
-    indexed_hashes = orchestrator.vector_db.get_indexed_sha256_hashes(user_id)
+    # Check only the candidate sha256 hashes against the vector DB
+    candidates = [doc["sha256"] for doc in unindexed if doc.get("sha256")]
+    indexed_hashes = orchestrator.vector_db.filter_existing_sha256(user_id, candidates)
     
     # Separate documents: already indexed (by content) vs truly new
     already_indexed_docs = []
@@ -100,7 +103,7 @@ async def sync_documents(request: SyncRequest):
     
     # If no new documents, we're done
     if not new_docs:
-        return SyncResponse(
+        return SyncResponse.model_construct(
             success=True,
             documentsIndexed=0,
             documentsSkipped=len(already_indexed_docs),
@@ -110,7 +113,7 @@ async def sync_documents(request: SyncRequest):
     indexed_file_ids = []
     
     # Group NEW documents by vendor for batch processing
-    vendors_data = {}
+    vendors_data = defaultdict(lambda: {"vendor_folder_id": None, "docs": []})
     for doc in new_docs:
         vendor_name = doc.get("vendorName", "Unknown")
         vendor_folder_id = doc.get("vendorFolderId")
@@ -119,12 +122,9 @@ async def sync_documents(request: SyncRequest):
             logger.warning(f"Skipping document {doc.get('driveFileId')}: no vendorFolderId")
             continue
             
-        if vendor_name not in vendors_data:
-            vendors_data[vendor_name] = {
-                "vendor_folder_id": vendor_folder_id,
-                "docs": []
-            }
-        vendors_data[vendor_name]["docs"].append(doc)
+        vendor_info = vendors_data[vendor_name]
+        vendor_info["vendor_folder_id"] = vendor_folder_id
+        vendor_info["docs"].append(doc)
     
     # Process each vendor's documents
     for vendor_name, vendor_info in vendors_data.items():
@@ -152,8 +152,8 @@ async def sync_documents(request: SyncRequest):
                 indexed_file_ids.extend(file_ids)
                 logger.info(f"[Sync] ✓ {vendor_name}: {len(file_ids)} docs")
                 
-        except Exception as e:
-            logger.error(f"Error indexing {vendor_name}: {e}")
+        except Exception:
+            logger.exception(f"Error indexing {vendor_name}")
             continue
     
     # Update MongoDB for newly indexed documents
@@ -162,7 +162,7 @@ async def sync_documents(request: SyncRequest):
     
     logger.info(f"[Sync] Complete: {len(indexed_file_ids)} indexed, {len(already_indexed_docs)} skipped")
     
-    return SyncResponse(
+    return SyncResponse.model_construct(
         success=True,
         documentsIndexed=len(indexed_file_ids),
         documentsSkipped=len(already_indexed_docs),
@@ -184,7 +184,7 @@ async def _fetch_master_via_email_service(user_id: str, vendor_folder_id: str) -
                 logger.error(f"Failed to fetch master.json: HTTP {response.status_code}")
                 return []
             
-            data = response.json()
+            data = orjson.loads(response.content)
             records = data.get("records", [])
             return records if isinstance(records, list) else []
             
@@ -240,7 +240,7 @@ async def query(request: QueryRequest):
         vendor_name=request.vendorName
     )
     
-    return QueryResponse(
+    return QueryResponse.model_construct(
         success=result.get("success", False),
         answer=result.get("answer", ""),
         sources=result.get("sources", []),
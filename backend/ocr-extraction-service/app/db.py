@@ -5,14 +5,22 @@ Connects to shared 'app_database' used by all services.
 import os
 import logging
 import certifi
-from pymongo import MongoClient, ASCENDING
+from bson import Binary
+from pymongo import MongoClient, ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
 from datetime import datetime, timezone
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
 _client = None
 _db = None
 
+# Structured-extraction cache lifetime; same setting (and default) as the on-disk LLM response cache
+OCR_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+# master.json mirrors are only a download shortcut; drop ones not refreshed for this long
+MASTER_MIRROR_TTL_SECONDS = int(os.getenv("MASTER_MIRROR_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+
 
 def get_db():
     """Get MongoDB database instance (lazy initialization)."""
@@ -35,6 +43,26 @@ def _init_indexes():
     docs = _db["documents"]
     docs.create_index([("userId", ASCENDING), ("driveFileId", ASCENDING)], unique=True)
     docs.create_index([("userId", ASCENDING), ("ocrStatus", ASCENDING), ("indexed", ASCENDING)])
+    # Per-vendor status dashboards/summaries and retry lookups (userId + vendorName [+ ocrStatus])
+    docs.create_index([("userId", ASCENDING), ("vendorName", ASCENDING), ("ocrStatus", ASCENDING)])
+    _init_ocr_cache_indexes()
+    mirror = _db["master_mirror"]
+    # Mirrors used to be keyed by folderId alone, without an owner to clear them by
+    if "folderId_1" in mirror.index_information():
+        mirror.drop_index("folderId_1")
+    mirror.create_index([("userId", ASCENDING), ("folderId", ASCENDING)], unique=True)
+    _ensure_ttl_index("master_mirror", "updatedAt", MASTER_MIRROR_TTL_SECONDS)
+
+
+def _ensure_ttl_index(collection: str, field: str, ttl_seconds: int):
+    """Create (or retune) a TTL index on field; no-op when ttl_seconds <= 0."""
+    if ttl_seconds <= 0:
+        return
+    try:
+        _db[collection].create_index([(field, ASCENDING)], expireAfterSeconds=ttl_seconds)
+    except OperationFailure:
+        # TTL changed since the index was created
+        _db.command("collMod", collection, index={"keyPattern": {field: 1}, "expireAfterSeconds": ttl_seconds})
 
 
 def upsert_document(
@@ -50,45 +78,53 @@ def upsert_document(
     vendor_id: str = None,
     gmail_message_id: str = None,
     gmail_attachment_id: str = None,
-) -> dict:
+    return_document: bool = False,
+) -> Optional[dict]:
     """
     Create or update a document record.
     Called by email service when uploading attachment to Drive.
+    Only returns the (slim) stored document when return_document is True.
     """
     db = get_db()
     docs = db["documents"]
     
     now = datetime.now(timezone.utc)
-    
-    result = docs.find_one_and_update(
-        {"userId": user_id, "driveFileId": drive_file_id},
-        {
-            "$set": {
-                "fileName": file_name,
-                "vendorName": vendor_name,
-                "vendorFolderId": vendor_folder_id,
-                "invoiceFolderId": invoice_folder_id,
-                "webViewLink": web_view_link,
-                "webContentLink": web_content_link,
-                "source": source,
-                "vendorId": vendor_id,
-                "gmailMessageId": gmail_message_id,
-                "gmailAttachmentId": gmail_attachment_id,
-                "updatedAt": now,
-            },
-            "$setOnInsert": {
-                "userId": user_id,
-                "driveFileId": drive_file_id,
-                "ocrStatus": "PENDING",
-                "indexed": False,
-                "indexVersion": 0,
-                "createdAt": now,
-            }
+    update = {
+        "$set": {
+            "fileName": file_name,
+            "vendorName": vendor_name,
+            "vendorFolderId": vendor_folder_id,
+            "invoiceFolderId": invoice_folder_id,
+            "webViewLink": web_view_link,
+            "webContentLink": web_content_link,
+            "source": source,
+            "vendorId": vendor_id,
+            "gmailMessageId": gmail_message_id,
+            "gmailAttachmentId": gmail_attachment_id,
+            "updatedAt": now,
         },
+        "$setOnInsert": {
+            "userId": user_id,
+            "driveFileId": drive_file_id,
+            "ocrStatus": "PENDING",
+            "indexed": False,
+            "indexVersion": 0,
+            "createdAt": now,
+        }
+    }
+    query = {"userId": user_id, "driveFileId": drive_file_id}
+
+    if not return_document:
+        docs.update_one(query, update, upsert=True)
+        return None
+
+    return docs.find_one_and_update(
+        query,
+        update,
+        projection={"_id": 1, "ocrStatus": 1, "indexed": 1},
         upsert=True,
-        return_document=True
+        return_document=ReturnDocument.AFTER
     )
-    return result
 
 
 def update_ocr_status(
@@ -105,6 +141,68 @@ def update_ocr_status(
     db = get_db()
     docs = db["documents"]
     
+    update_fields = _ocr_status_fields(ocr_status, master_json_path, ocr_error)
+    
+    result = docs.update_one(
+        {"userId": user_id, "driveFileId": drive_file_id},
+        {"$set": update_fields}
+    )
+    return result.modified_count > 0
+
+
+def update_ocr_statuses_bulk(
+    user_id: str,
+    drive_file_ids: list,
+    ocr_status: str,
+    master_json_path: str = None,
+    ocr_error: str = None,
+) -> int:
+    """
+    Apply the same OCR status update to many documents in one round-trip.
+    Returns count of updated documents.
+    """
+    if not drive_file_ids:
+        return 0
+
+    db = get_db()
+    docs = db["documents"]
+    
+    update_fields = _ocr_status_fields(ocr_status, master_json_path, ocr_error)
+    
+    result = docs.update_many(
+        {"userId": user_id, "driveFileId": {"$in": list(drive_file_ids)}},
+        {"$set": update_fields}
+    )
+    return result.modified_count
+
+
+def mark_ocr_failures_bulk(user_id: str, failures: dict) -> int:
+    """
+    Mark many documents FAILED, each with its own error, in one bulk write.
+    Also bumps ocrFailureCount and stamps lastFailedAt for retry backoff.
+    failures maps driveFileId -> error message. Returns count of updated documents.
+    """
+    if not failures:
+        return 0
+
+    db = get_db()
+    docs = db["documents"]
+    
+    operations = []
+    for drive_file_id, error in failures.items():
+        update_fields = _ocr_status_fields("FAILED", ocr_error=error)
+        # Failure count + time drive the retry backoff
+        update_fields["lastFailedAt"] = update_fields["updatedAt"]
+        operations.append(UpdateOne(
+            {"userId": user_id, "driveFileId": drive_file_id},
+            {"$set": update_fields, "$inc": {"ocrFailureCount": 1}},
+        ))
+    result = docs.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+def _ocr_status_fields(ocr_status: str, master_json_path: str = None, ocr_error: str = None) -> dict:
+    """Build the $set fields for an OCR status transition."""
     now = datetime.now(timezone.utc)
     update_fields = {
         "ocrStatus": ocr_status,
@@ -114,17 +212,98 @@ def update_ocr_status(
     if ocr_status == "COMPLETED":
         update_fields["ocrCompletedAt"] = now
         update_fields["indexed"] = False  # Reset indexed flag for new OCR
+        update_fields["ocrFailureCount"] = 0  # Next failure starts the retry backoff over
         if master_json_path:
             update_fields["masterJsonPath"] = master_json_path
     
     if ocr_error:
         update_fields["ocrError"] = ocr_error
     
-    result = docs.update_one(
-        {"userId": user_id, "driveFileId": drive_file_id},
-        {"$set": update_fields}
+    return update_fields
+
+
+def _init_ocr_cache_indexes():
+    """Key the OCR cache by (sha256, model) and expire entries after OCR_CACHE_TTL_SECONDS."""
+    cache = _db["ocr_cache"]
+    # Entries used to be keyed by sha256 alone; that unique index would block per-model entries
+    if "sha256_1" in cache.index_information():
+        cache.drop_index("sha256_1")
+    cache.create_index([("sha256", ASCENDING), ("model", ASCENDING)], unique=True)
+    _ensure_ttl_index("ocr_cache", "createdAt", OCR_CACHE_TTL_SECONDS)
+
+
+def get_ocr_cache(sha256: str, model: str) -> dict:
+    """
+    Get the structured OCR payload previously extracted by this model from a PDF
+    with this content hash. Returns None on a miss or when caching is disabled.
+    """
+    if OCR_CACHE_TTL_SECONDS <= 0:
+        return None
+    db = get_db()
+    entry = db["ocr_cache"].find_one({"sha256": sha256, "model": model}, {"_id": 0, "payload": 1})
+    return entry["payload"] if entry else None
+
+
+def set_ocr_cache_bulk(payloads: dict, model: str) -> int:
+    """
+    Store structured OCR payloads extracted by model, keyed by PDF content hash
+    (sha256 -> payload). Returns count of new cache entries.
+    """
+    if not payloads or OCR_CACHE_TTL_SECONDS <= 0:
+        return 0
+
+    db = get_db()
+    now = datetime.now(timezone.utc)
+    # createdAt is reset on every write so the TTL counts from the latest extraction
+    operations = [
+        UpdateOne(
+            {"sha256": sha256, "model": model},
+            {"$set": {"payload": payload, "createdAt": now}},
+            upsert=True,
+        )
+        for sha256, payload in payloads.items()
+    ]
+    result = db["ocr_cache"].bulk_write(operations, ordered=False)
+    return result.upserted_count
+
+
+# Leave headroom under MongoDB's 16MB document limit
+MASTER_MIRROR_MAX_BYTES = 15 << 20
+
+
+def get_master_mirror(user_id: str, folder_id: str) -> dict:
+    """
+    Get the user's mirrored master.json for a Drive folder as {"md5Checksum", "content"}.
+    Returns None on a miss.
+    """
+    db = get_db()
+    return db["master_mirror"].find_one(
+        {"userId": user_id, "folderId": folder_id}, {"_id": 0, "md5Checksum": 1, "content": 1}
     )
-    return result.modified_count > 0
+
+
+def set_master_mirror(user_id: str, folder_id: str, md5_checksum: str, content: bytes) -> bool:
+    """
+    Mirror master.json bytes for a user's Drive folder together with the Drive md5Checksum
+    they correspond to. Oversized files are not mirrored (any stale copy is dropped).
+    """
+    db = get_db()
+    if not md5_checksum or len(content) > MASTER_MIRROR_MAX_BYTES:
+        db["master_mirror"].delete_one({"userId": user_id, "folderId": folder_id})
+        return False
+
+    db["master_mirror"].update_one(
+        {"userId": user_id, "folderId": folder_id},
+        {"$set": {"md5Checksum": md5_checksum, "content": Binary(content), "updatedAt": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    return True
+
+
+def delete_master_mirrors(user_id: str) -> int:
+    """Delete every mirrored master.json of a user. Returns count deleted."""
+    db = get_db()
+    return db["master_mirror"].delete_many({"userId": user_id}).deleted_count
 
 
 def get_pending_ocr_documents(user_id: str) -> list:
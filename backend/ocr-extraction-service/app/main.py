@@ -13,8 +13,11 @@ from config.load_env import *
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.routes import base_routes, invoice_routes, pdf_ocr_routes, processing_routes, retry_routes, text_to_json
+from app.services.gemini_client import close_llm_client
+from app.services.invoice_processor import close_http_client
 
 # Configure logging
 logging.basicConfig(
@@ -41,9 +44,11 @@ async def lifespan(app: FastAPI):
     logger.info(f"OCR Service initialized on port {OCR_PORT}")
     yield
     logger.info("Shutting down OCR Service...")
+    await close_llm_client()
+    await close_http_client()
 
 
-app = FastAPI(title="Invoice OCR Service", lifespan=lifespan)
+app = FastAPI(title="Invoice OCR Service", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -72,4 +77,5 @@ if __name__ == "__main__":
 
     ensure_folder_exists(INVOICES_JSON_FOLDER)
     ensure_folder_exists(PROCESSING_STATUS_DIR)
-    uvicorn.run(app, host="0.0.0.0", port=OCR_PORT)
+    # loop="auto" runs on uvloop when installed (see requirements), else asyncio
+    uvicorn.run(app, host="0.0.0.0", port=OCR_PORT, loop="auto")
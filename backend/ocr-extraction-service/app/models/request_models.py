@@ -0,0 +1,37 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class InvoicePayload(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    fileId: str = Field(..., description="Drive file ID")
+    fileName: str = Field(..., description="Original filename")
+    mimeType: Optional[str] = Field("application/pdf", description="File MIME type")
+
+
+class VendorProcessingRequest(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    userId: str = Field(..., description="Internal user identifier")
+    vendorName: str = Field(..., description="Display name for vendor")
+    vendorFolderId: Optional[str] = Field(None, description="Drive folder ID for the vendor root")
+    invoiceFolderId: Optional[str] = Field(None, description="Drive folder ID for the invoices subfolder")
+    refreshToken: str = Field(..., description="Google OAuth refresh token for Drive access")
+    invoices: List[InvoicePayload] = Field(default_factory=list)
+
+
+class FullSyncRequest(BaseModel):
+    userId: str = Field(..., description="Internal user identifier")
+    refreshToken: str = Field(..., description="Google OAuth refresh token for Drive access")
+
+
+class RetryRequest(BaseModel):
+    """Request model for retrying failed invoices"""
+    userId: str = Field(..., description="User identifier")
+    vendorName: Optional[str] = Field(None, description="Specific vendor to retry (if None, retry all failed)")
+    driveFileIds: Optional[List[str]] = Field(None, description="Specific file IDs to retry (if None, retry all failed for vendor)")
+    refreshToken: str = Field(..., description="Google OAuth refresh token for Drive access")
+    maxOcrRetries: int = Field(3, description="Maximum OCR retry attempts")
+    maxChatRetries: int = Field(3, description="Maximum chat indexing retry attempts")
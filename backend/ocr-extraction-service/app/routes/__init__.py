@@ -1,9 +1,10 @@
-from . import base_routes, invoice_routes, pdf_ocr_routes, processing_routes, text_to_json
+from . import base_routes, invoice_routes, pdf_ocr_routes, processing_routes, retry_routes, text_to_json
 
 __all__ = [
 	"base_routes",
 	"invoice_routes",
 	"pdf_ocr_routes",
 	"processing_routes",
+	"retry_routes",
 	"text_to_json",
 ]
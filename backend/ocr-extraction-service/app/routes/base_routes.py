@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Request
 
+from app.services.gemini_client import gemini_breaker_state
+
 router = APIRouter(
     prefix="/api",
     tags=["Base"]
@@ -13,5 +15,6 @@ async def health_check(request: Request):
     return {
         "status": "ok",
         "service": "invoice-ocr",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "gemini_breaker_state": gemini_breaker_state()
     }
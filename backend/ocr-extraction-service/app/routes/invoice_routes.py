@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from app.services.pdf_extractor import extract_text_from_pdf
 from app.services.gemini_client import extract_invoice_json_from_text
@@ -17,12 +19,12 @@ async def extract_invoice(file: UploadFile = File(...)):
 
     try:
         # Step 1: Extract text from PDF
-        pdf_text = extract_text_from_pdf(file)
+        pdf_text = await asyncio.to_thread(extract_text_from_pdf, file)
         if not pdf_text.strip():
             return {"error": "No text found in the PDF.", "retryable": False}
 
         # Step 2: Send text to Gemini API
-        result = extract_invoice_json_from_text(pdf_text)
+        result = await extract_invoice_json_from_text(pdf_text)
         
         # Return result as-is (including error dict with retryable flag if present)
         return result
@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from app.services.pdf_extractor import extract_text_from_pdf
 
@@ -12,7 +14,8 @@ async def extract_text(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Only PDF files are supported.")
 
     try:
-        text = extract_text_from_pdf(file)
+        # pdfminer is CPU-bound; run it off the event loop
+        text = await asyncio.to_thread(extract_text_from_pdf, file)
         if not text.strip():
             raise HTTPException(status_code=400, detail="No text extracted from the PDF.")
         return {"text": text.strip()}
@@ -1,39 +1,18 @@
-import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List
 import logging
 
 from fastapi import APIRouter, HTTPException, status
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import TypeAdapter
 
+from app.models.request_models import FullSyncRequest, InvoicePayload, VendorProcessingRequest
 from app.services.invoice_processor import process_all_invoices, process_vendor_invoices
 
 router = APIRouter(prefix="/api/v1/processing", tags=["Processing"], include_in_schema=False)
 
 logger = logging.getLogger(__name__)
 
-
-class InvoicePayload(BaseModel):
-    model_config = ConfigDict(extra="allow")
-
-    fileId: str = Field(..., description="Drive file ID")
-    fileName: str = Field(..., description="Original filename")
-    mimeType: Optional[str] = Field("application/pdf", description="File MIME type")
-
-
-class VendorProcessingRequest(BaseModel):
-    model_config = ConfigDict(extra="allow")
-
-    userId: str = Field(..., description="Internal user identifier")
-    vendorName: str = Field(..., description="Display name for vendor")
-    vendorFolderId: Optional[str] = Field(None, description="Drive folder ID for the vendor root")
-    invoiceFolderId: Optional[str] = Field(None, description="Drive folder ID for the invoices subfolder")
-    refreshToken: str = Field(..., description="Google OAuth refresh token for Drive access")
-    invoices: List[InvoicePayload] = Field(default_factory=list)
-
-
-class FullSyncRequest(BaseModel):
-    userId: str = Field(..., description="Internal user identifier")
-    refreshToken: str = Field(..., description="Google OAuth refresh token for Drive access")
+# Compiled once; dumps a whole invoice list in a single serializer pass
+_INVOICE_LIST_ADAPTER = TypeAdapter(List[InvoicePayload])
 
 
 @router.post("/vendor", status_code=status.HTTP_200_OK)
@@ -51,7 +30,7 @@ async def process_vendor(payload: VendorProcessingRequest) -> Dict[str, Any]:
         user_id=payload.userId,
         vendor_name=payload.vendorName,
         invoice_folder_id=payload.invoiceFolderId,
-        invoices=[invoice.model_dump() for invoice in payload.invoices],
+        invoices=_INVOICE_LIST_ADAPTER.dump_python(payload.invoices),
         vendor_folder_id=payload.vendorFolderId,
         refresh_token=payload.refreshToken,
     )
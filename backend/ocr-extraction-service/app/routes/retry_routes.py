@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from typing import Optional
+import asyncio
+import hashlib
 import logging
 
+import orjson
+
+from app.models.request_models import RetryRequest
 from app.services.retry_service import (
     get_processing_status,
     retry_failed_invoices,
@@ -15,21 +19,24 @@ router = APIRouter(prefix="/api/v1/processing", tags=["Processing & Retry"])
 logger = logging.getLogger(__name__)
 
 
-class RetryRequest(BaseModel):
-    """Request model for retrying failed invoices"""
-    userId: str = Field(..., description="User identifier")
-    vendorName: Optional[str] = Field(None, description="Specific vendor to retry (if None, retry all failed)")
-    driveFileIds: Optional[List[str]] = Field(None, description="Specific file IDs to retry (if None, retry all failed for vendor)")
-    refreshToken: str = Field(..., description="Google OAuth refresh token for Drive access")
-    maxOcrRetries: int = Field(3, description="Maximum OCR retry attempts")
-    maxChatRetries: int = Field(3, description="Maximum chat indexing retry attempts")
+def _etag_response(request: Request, payload: dict) -> Response:
+    """Serialize payload once and answer 304 when the client already holds it."""
+    body = orjson.dumps(payload)
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    client_etags = request.headers.get("if-none-match", "")
+    if etag in (tag.strip().removeprefix("W/") for tag in client_etags.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 
 @router.get("/status", summary="Get Invoice Processing Status")
 async def get_status_endpoint(
+    request: Request,
     userId: str = Query(..., description="User identifier"),
     vendorName: Optional[str] = Query(None, description="Filter by vendor name"),
-    status: Optional[str] = Query(None, description="Filter by status (e.g., OCR_FAILED, CHAT_FAILED)"),
+    status: Optional[str] = Query(None, description="Filter by OCR status (PENDING, PROCESSING, COMPLETED, FAILED)"),
+    skip: int = Query(0, ge=0, description="Invoice rows to skip (with limit)"),
+    limit: Optional[int] = Query(None, ge=0, description="Max invoice rows to return; 0 returns counts only"),
 ):
     """Get processing status for invoices with detailed information."""
     logger.info(f"Getting status for user: {userId}, vendor: {vendorName}, status: {status}")
@@ -37,29 +44,32 @@ async def get_status_endpoint(
     result = await get_processing_status(
         user_id=userId,
         vendor_name=vendorName,
-        status_filter=status
+        status_filter=status,
+        skip=skip,
+        limit=limit,
     )
     
     if not result.get("success"):
         raise HTTPException(status_code=500, detail=result.get("error", "Failed to get status"))
     
-    return result
+    return _etag_response(request, result)
 
 
 @router.get("/status/summary", summary="Get Processing Status Summary")
 async def get_summary_endpoint(
+    request: Request,
     userId: str = Query(..., description="User identifier"),
     vendorName: Optional[str] = Query(None, description="Filter by vendor name"),
 ):
     """Get a quick summary of processing status (counts by status)."""
     logger.info(f"Getting status summary for user: {userId}, vendor: {vendorName}")
     
-    result = get_status_summary(user_id=userId, vendor_name=vendorName)
+    result = await get_status_summary(user_id=userId, vendor_name=vendorName)
     
     if not result.get("success"):
         raise HTTPException(status_code=500, detail=result.get("error", "Failed to get summary"))
     
-    return result
+    return _etag_response(request, result)
 
 
 @router.post("/retry", summary="Retry Failed Invoice Processing")
@@ -96,7 +106,7 @@ async def clear_status_endpoint(
     """Clear all processing status records for a user."""
     logger.info(f"Clearing processing status for user: {userId}")
     
-    result = clear_user_documents(user_id=userId)
+    result = await asyncio.to_thread(clear_user_documents, user_id=userId)
     
     if not result.get("success"):
         raise HTTPException(status_code=500, detail=result.get("error", "Failed to clear status"))
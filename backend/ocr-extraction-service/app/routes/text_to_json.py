@@ -7,7 +7,7 @@ router = APIRouter(prefix="/ocr", tags=["Invoice OCR"])
 SPREADSHEET_SERVICE_URL = "http://localhost:4004/api/v1/sheets/update"
 
 @router.post("/text_to_json", response_model=GeminiResponse, summary="Extract structured invoice text to JSON using Gemini")
-def extract_json_from_text(text: str):
+async def extract_json_from_text(text: str):
     """
     Convert extracted PDF text into structured invoice JSON using Gemini API.
     """
@@ -16,7 +16,7 @@ def extract_json_from_text(text: str):
         raise HTTPException(status_code=400, detail="Input text is empty.")
 
     try:
-        result = extract_invoice_json_from_text(text)
+        result = await extract_invoice_json_from_text(text)
         if "error" in result:
             error_msg = result["error"]
 
@@ -1,7 +1,17 @@
 import os
 import json
 import logging
+import asyncio
+import re
 import time
+import uuid
+from typing import Dict, List, Optional, Union
+
+import httpx
+from aiolimiter import AsyncLimiter
+
+from app.services.llm_cache import cache_key, get_cached, get_cached_many, set_cached, set_cached_many
+from app.utils.backoff import retry_delay
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +26,37 @@ GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://host.docker.internal:11434")
 LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "mistral:latest")
 
+# Proactive throttle so concurrent callers stay under the Gemini quota
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+_gemini_limiter = AsyncLimiter(GEMINI_RPM, 60)
+
+# Shared keep-alive client for LLM HTTP calls (created lazily)
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(45.0),
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+        )
+    return _http_client
+
+
+async def close_llm_client() -> None:
+    """Close the shared LLM HTTP client (called on app shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def active_model() -> str:
+    """Provider-qualified model name for the configured LLM (part of the extraction cache keys)."""
+    return f"ollama:{LOCAL_LLM_MODEL}" if LLM_PROVIDER == "ollama" else f"gemini:{GEMINI_MODEL}"
+
 
 def get_llm_client():
     """Configuration for the LLM client"""
@@ -38,10 +79,34 @@ def get_llm_client():
         }
 
 
-def call_ollama(prompt: str, config: dict, max_retries: int = 2) -> dict:
+_json_decoder = json.JSONDecoder()
+
+
+def _parse_llm_json(text: str) -> Union[dict, list, None]:
+    """
+    Parse a JSON object from model output, tolerating surrounding prose.
+    A bare top-level array (possible without a response schema) is returned
+    as-is for the caller to interpret; other non-object values yield None.
+    """
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    else:
+        if isinstance(value, (dict, list)):
+            return value
+    start = text.find("{")
+    while start != -1:
+        try:
+            # raw_decode stops at the matching close brace, ignoring braces inside strings
+            return _json_decoder.raw_decode(text, start)[0]
+        except json.JSONDecodeError:
+            start = text.find("{", start + 1)
+    return None
+
+
+async def call_ollama(prompt: str, config: dict, max_retries: int = 2) -> Union[dict, list]:
     """Call Ollama API for local LLM inference."""
-    import requests
-    
     url = f"{config['base_url']}/api/generate"
     payload = {
         "model": config["model"],
@@ -55,28 +120,22 @@ def call_ollama(prompt: str, config: dict, max_retries: int = 2) -> dict:
     
     while retry_count <= max_retries:
         try:
-            response = requests.post(url, json=payload, timeout=60)
+            response = await _get_http_client().post(url, json=payload, timeout=60)
             response.raise_for_status()
             
             data = response.json()
             response_text = data.get("response", "")
             
-            # Try parsing as JSON
-            try:
-                return json.loads(response_text)
-            except json.JSONDecodeError:
-                # Extract JSON if wrapped in text
-                start = response_text.find("{")
-                end = response_text.rfind("}")
-                if start != -1 and end != -1:
-                    return json.loads(response_text[start:end + 1])
+            parsed = _parse_llm_json(response_text)
+            if parsed is None:
                 return {"error": "Invalid JSON returned by Ollama", "retryable": False}
+            return parsed
                 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             if retry_count < max_retries:
                 delay = base_delay * (2 ** retry_count)
                 logging.warning(f"Ollama timeout. Retrying in {delay}s...")
-                time.sleep(delay)
+                await asyncio.sleep(delay)
                 retry_count += 1
                 continue
             return {"error": "Ollama timeout", "retryable": True}
@@ -87,17 +146,92 @@ def call_ollama(prompt: str, config: dict, max_retries: int = 2) -> dict:
     return {"error": "Max retries exceeded", "retryable": True}
 
 
-def call_gemini(prompt: str, config: dict, max_retries: int = 3) -> dict:
+class _CircuitBreaker:
+    """Fail fast after consecutive retryable failures; allow one trial call after reset_timeout."""
+
+    def __init__(self, fail_max: int, reset_timeout: float):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record(self, success: bool) -> None:
+        self._trial_in_flight = False
+        if success:
+            self._failures = 0
+            self._opened_at = None
+            return
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self.fail_max:
+            if self._opened_at is None:
+                logger.error(f"Gemini circuit opened after {self._failures} consecutive failures")
+            self._opened_at = time.monotonic()
+
+
+_gemini_breaker = _CircuitBreaker(
+    fail_max=int(os.getenv("GEMINI_BREAKER_FAIL_MAX", "5")),
+    reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "60")),
+)
+
+
+def gemini_breaker_state() -> str:
+    """Current Gemini circuit state: closed, open or half_open."""
+    return _gemini_breaker.state
+
+
+async def call_gemini(
+    prompt: str, config: dict, max_retries: int = 3, response_schema: Optional[dict] = None
+) -> Union[dict, list]:
+    """Call Gemini behind the circuit breaker so a sustained outage fails fast."""
+    if not _gemini_breaker.allow():
+        return {"error": "circuit open", "retryable": True}
+
+    # Cancelled or raising calls count as failures; recording always releases a half-open trial
+    failed = True
+    try:
+        result = await _call_gemini_with_retries(prompt, config, max_retries, response_schema)
+        failed = isinstance(result, dict) and bool(result.get("error")) and bool(result.get("retryable"))
+        return result
+    finally:
+        _gemini_breaker.record(not failed)
+
+
+async def _call_gemini_with_retries(
+    prompt: str, config: dict, max_retries: int = 3, response_schema: Optional[dict] = None
+) -> Union[dict, list]:
     """Call Google Gemini API for production inference with rate limiting."""
-    import requests
-    
     headers = {
         "Content-Type": "application/json",
-        "x-goog-api-key": config["api_key"]
+        "x-goog-api-key": config["api_key"],
+        # Same id across retries of one logical request
+        "X-Request-Id": str(uuid.uuid4()),
     }
     
+    # Structured output: Gemini returns strict JSON, deterministic for a given prompt
+    generation_config = {"responseMimeType": "application/json", "temperature": 0}
+    if response_schema:
+        generation_config["responseSchema"] = response_schema
     payload = {
-        "contents": [{"parts": [{"text": prompt}]}]
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": generation_config,
     }
     
     retry_count = 0
@@ -105,14 +239,15 @@ def call_gemini(prompt: str, config: dict, max_retries: int = 3) -> dict:
     
     while retry_count <= max_retries:
         try:
-            response = requests.post(config["url"], headers=headers, json=payload, timeout=45)
+            async with _gemini_limiter:
+                response = await _get_http_client().post(config["url"], headers=headers, json=payload)
             
             # Handle rate limiting
             if (response.status_code == 429):
                 if retry_count < max_retries:
-                    delay = base_delay * (2 ** retry_count)
-                    logger.warning(f"Rate limit hit (429). Retrying in {delay}s... (attempt {retry_count + 1}/{max_retries})")
-                    time.sleep(delay)
+                    delay = retry_delay(retry_count, base_delay, response)
+                    logger.warning(f"Rate limit hit (429). Retrying in {delay:.1f}s... (attempt {retry_count + 1}/{max_retries})")
+                    await asyncio.sleep(delay)
                     retry_count += 1
                     continue
                 return {"error": "Rate limit exceeded", "retryable": True}
@@ -120,9 +255,9 @@ def call_gemini(prompt: str, config: dict, max_retries: int = 3) -> dict:
             # Handle server errors
             if response.status_code >= 500:
                 if retry_count < max_retries:
-                    delay = base_delay * (2 ** retry_count)
-                    logger.warning(f"Server error ({response.status_code}). Retrying in {delay}s... (attempt {retry_count + 1}/{max_retries})")
-                    time.sleep(delay)
+                    delay = retry_delay(retry_count, base_delay, response)
+                    logger.warning(f"Server error ({response.status_code}). Retrying in {delay:.1f}s... (attempt {retry_count + 1}/{max_retries})")
+                    await asyncio.sleep(delay)
                     retry_count += 1
                     continue
                 return {"error": f"Server error: {response.status_code}", "retryable": True}
@@ -135,25 +270,17 @@ def call_gemini(prompt: str, config: dict, max_retries: int = 3) -> dict:
             if not model_output:
                 return {"error": "Empty response from Gemini", "retryable": False}
             
-            # Parse JSON
-            try:
-                return json.loads(model_output)
-            except json.JSONDecodeError:
-                start = model_output.find("{")
-                end = model_output.rfind("}")
-                if start != -1 and end != -1:
-                    try:
-                        return json.loads(model_output[start:end + 1])
-                    except json.JSONDecodeError:
-                        logger.error(f"Invalid JSON from Gemini: {model_output[:100]}")
-                        return {"error": "Invalid JSON from Gemini", "retryable": False}
+            parsed = _parse_llm_json(model_output)
+            if parsed is None:
+                logger.error(f"Invalid JSON from Gemini: {model_output[:100]}")
                 return {"error": "Invalid JSON from Gemini", "retryable": False}
+            return parsed
                 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             if retry_count < max_retries:
-                delay = base_delay * (2 ** retry_count)
-                logger.warning(f"Gemini timeout. Retrying in {delay}s... (attempt {retry_count + 1}/{max_retries})")
-                time.sleep(delay)
+                delay = retry_delay(retry_count, base_delay)
+                logger.warning(f"Gemini timeout. Retrying in {delay:.1f}s... (attempt {retry_count + 1}/{max_retries})")
+                await asyncio.sleep(delay)
                 retry_count += 1
                 continue
             return {"error": "Request timeout", "retryable": True}
@@ -165,38 +292,240 @@ def call_gemini(prompt: str, config: dict, max_retries: int = 3) -> dict:
     return {"error": "Max retries exceeded", "retryable": True}
 
 
-def extract_invoice_json_from_text(extracted_text: str, max_retries: int = 3):
-    """Send extracted PDF text to LLM and receive structured invoice JSON."""
-    
-    prompt = f"""Extract structured invoice information from the following text. 
-Return output ONLY in JSON format with these fields (no extra explanations):
-{{
+INVOICE_JSON_TEMPLATE = """{
     "vendor_name": "",
     "invoice_number": "",
     "invoice_date": "",
     "total_amount": "",
     "line_items": [
-        {{
+        {
             "item_description": "",
             "quantity": "",
             "unit_price": "",
             "amount": ""
-        }}
+        }
     ]
-}}
+}"""
 
-Text:
-{extracted_text}
-"""
-    
+_STRING = {"type": "STRING"}
+
+# OpenAPI-style schema mirroring INVOICE_JSON_TEMPLATE, for Gemini structured output
+INVOICE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "vendor_name": _STRING,
+        "invoice_number": _STRING,
+        "invoice_date": _STRING,
+        "total_amount": _STRING,
+        "line_items": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "item_description": _STRING,
+                    "quantity": _STRING,
+                    "unit_price": _STRING,
+                    "amount": _STRING,
+                },
+            },
+        },
+    },
+}
+
+BATCH_INVOICE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "invoices": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"index": {"type": "INTEGER"}, **INVOICE_SCHEMA["properties"]},
+                "required": ["index"],
+            },
+        },
+    },
+    "required": ["invoices"],
+}
+
+
+# Sync pipeline only: OCR text too short or without any invoice vocabulary is scan noise; skip the LLM
+MIN_INVOICE_TEXT_CHARS = int(os.getenv("MIN_INVOICE_TEXT_CHARS", "300"))
+_INVOICE_HINT_RE = re.compile(r"invoice|total|amount|bill|\$|€|₹|£", re.IGNORECASE)
+
+
+def _insufficient_text(text: str) -> Optional[dict]:
+    """Return an error result when text can't plausibly hold an invoice, else None."""
+    if len(text) < MIN_INVOICE_TEXT_CHARS or not _INVOICE_HINT_RE.search(text):
+        return {"error": "insufficient text", "retryable": False}
+    return None
+
+
+async def _call_llm(prompt: str, max_retries: int, response_schema: Optional[dict] = None) -> Union[dict, list]:
+    """Dispatch a prompt to the configured LLM provider."""
     try:
         llm_config = get_llm_client()
         
         if llm_config["type"] == "ollama":
-            return call_ollama(prompt, llm_config, max_retries)
+            return await call_ollama(prompt, llm_config, max_retries)
         else:
-            return call_gemini(prompt, llm_config, max_retries)
+            return await call_gemini(prompt, llm_config, max_retries, response_schema)
             
     except Exception as e:
         logger.error(f"LLM configuration error: {e}")
-        return {"error": str(e), "retryable": False}
\ No newline at end of file
+        return {"error": str(e), "retryable": False}
+
+
+# cache key -> future for an extraction currently in progress, so concurrent
+# requests for the same text share one LLM call instead of racing the cache
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+async def _await_inflight(future: asyncio.Future) -> dict:
+    try:
+        return dict(await asyncio.shield(future))
+    except asyncio.CancelledError:
+        if future.cancelled():
+            return {"error": "Concurrent extraction was cancelled", "retryable": True}
+        raise
+
+
+def _claim_inflight(key: str) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    return future
+
+
+def _release_inflight(key: str, future: asyncio.Future) -> None:
+    if not future.done():
+        future.cancel()
+    if _inflight.get(key) is future:
+        del _inflight[key]
+
+
+async def _extract_single(extracted_text: str, max_retries: int) -> dict:
+    prompt = f"""Extract structured invoice information from the following text. 
+Return output ONLY in JSON format with these fields (no extra explanations):
+{INVOICE_JSON_TEMPLATE}
+
+Text:
+{extracted_text}
+"""
+    result = await _call_llm(prompt, max_retries, INVOICE_SCHEMA)
+    if isinstance(result, list):
+        # Schema-less providers may wrap the single invoice in an array
+        if len(result) == 1 and isinstance(result[0], dict):
+            return result[0]
+        return {"error": "Expected a single invoice object from LLM", "retryable": False}
+    return result
+
+
+async def extract_invoice_json_from_text(extracted_text: str, max_retries: int = 3):
+    """
+    Send extracted PDF text to LLM and receive structured invoice JSON.
+    Backs the public text/PDF routes, so the short-text gate (a sync
+    pipeline shortcut) is not applied here.
+    """
+    key = cache_key(active_model(), extracted_text)
+    # diskcache is SQLite-backed; keep its I/O off the event loop
+    cached = await asyncio.to_thread(get_cached, key)
+    if cached is not None:
+        return dict(cached)
+
+    if key in _inflight:
+        return await _await_inflight(_inflight[key])
+
+    future = _claim_inflight(key)
+    try:
+        result = await _extract_single(extracted_text, max_retries)
+        future.set_result(result)
+        await asyncio.to_thread(set_cached, key, result)
+        return result
+    finally:
+        _release_inflight(key, future)
+
+
+def _build_batch_prompt(texts: List[str]) -> str:
+    sections = "\n\n".join(f"=== INVOICE {k} ===\n{text}" for k, text in enumerate(texts))
+    return f"""Extract structured invoice information from each of the {len(texts)} invoices below.
+Return output ONLY in JSON format (no extra explanations) as {{"invoices": [...]}}.
+The array must contain one object per invoice, each with an "index" field set to the
+number in that invoice's "=== INVOICE k ===" header, plus these fields:
+{INVOICE_JSON_TEMPLATE}
+
+{sections}
+"""
+
+
+def _split_batch_response(response, count: int) -> List[dict]:
+    """Map a batched {"invoices": [...]} (or bare [...]) response back to per-invoice results."""
+    if isinstance(response, list):
+        items = response
+    elif isinstance(response, dict):
+        if "error" in response:
+            return [dict(response) for _ in range(count)]
+        items = response.get("invoices")
+    else:
+        items = None
+    if not isinstance(items, list):
+        error = {"error": "Invalid batch JSON returned by LLM", "retryable": True}
+        return [dict(error) for _ in range(count)]
+
+    results: List[Optional[dict]] = [None] * count
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        index = item.pop("index", position)
+        if isinstance(index, int) and 0 <= index < count and results[index] is None:
+            results[index] = item
+
+    missing = {"error": "Invoice missing from batch LLM response", "retryable": True}
+    return [result if result is not None else dict(missing) for result in results]
+
+
+async def extract_invoice_jsons_batch(texts: List[str], batch_size: int = 8, max_retries: int = 3) -> List[dict]:
+    """
+    Extract structured JSON for several invoices, sending up to batch_size
+    texts per LLM call so the instructions are paid for once per batch.
+    Results are returned in the same order as texts.
+    """
+    model = active_model()
+    keys = [cache_key(model, text) for text in texts]
+    results: List[Optional[dict]] = [_insufficient_text(text) for text in texts]
+    # One off-loop pass over the (SQLite-backed) cache for every text that passed the gate
+    lookup = [i for i, result in enumerate(results) if result is None]
+    for i, cached in zip(lookup, await asyncio.to_thread(get_cached_many, [keys[i] for i in lookup])):
+        results[i] = cached
+
+    # Texts already being extracted (here or by a concurrent call) are awaited, not re-sent
+    misses: List[int] = []
+    waiting: Dict[int, asyncio.Future] = {}
+    owned: Dict[str, asyncio.Future] = {}
+    for i, result in enumerate(results):
+        if result is not None:
+            continue
+        key = keys[i]
+        if key in _inflight:
+            waiting[i] = _inflight[key]
+        else:
+            owned[key] = _claim_inflight(key)
+            misses.append(i)
+
+    try:
+        for start in range(0, len(misses), batch_size):
+            chunk = misses[start:start + batch_size]
+            if len(chunk) == 1:
+                chunk_results = [await _extract_single(texts[chunk[0]], max_retries)]
+            else:
+                response = await _call_llm(_build_batch_prompt([texts[i] for i in chunk]), max_retries, BATCH_INVOICE_SCHEMA)
+                chunk_results = _split_batch_response(response, len(chunk))
+            for i, result in zip(chunk, chunk_results):
+                owned[keys[i]].set_result(result)
+                results[i] = result
+            await asyncio.to_thread(set_cached_many, [(keys[i], results[i]) for i in chunk])
+    finally:
+        for key, future in owned.items():
+            _release_inflight(key, future)
+
+    for i, future in waiting.items():
+        results[i] = await _await_inflight(future)
+    return [dict(result) for result in results]
@@ -1,18 +1,29 @@
-import json
+import hashlib
 import logging
 import os
 import tempfile
+import uuid
 import asyncio
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timezone
-from typing import Dict, List, Optional
+from typing import IO, Dict, List, Optional, Tuple
 
 import httpx
+import orjson
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 
-from app.db import update_ocr_status
+from app.db import (
+    get_db,
+    get_master_mirror,
+    get_ocr_cache,
+    mark_ocr_failures_bulk,
+    set_master_mirror,
+    set_ocr_cache_bulk,
+    update_ocr_statuses_bulk,
+)
+from app.services.gemini_client import active_model, extract_invoice_jsons_batch
+from app.utils.backoff import retry_delay
 
 logger = logging.getLogger(__name__)
 
@@ -23,152 +34,387 @@ OCR_PORT = int(os.getenv("OCR_SERVICE_PORT", "4003"))
 OCR_INTERNAL_BASE_URL = os.getenv("OCR_SERVICE_URL", f"http://127.0.0.1:{OCR_PORT}")
 INVOICES_ROOT = os.getenv("INVOICES_JSON_FOLDER", "invoices_json")
 DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive.file"]
-
-# Rate limiting: delay between Gemini API calls to avoid 429 errors
-GEMINI_API_DELAY = int(os.getenv("GEMINI_API_DELAY_SECONDS", "5"))
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+DRIVE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files"
+# PDFs larger than this spill from memory to a temp file while downloading
+PDF_SPOOL_MAX_BYTES = 2 << 20
+# Read size for streamed Drive downloads; 1 MiB keeps Python-level iterations low
+PDF_CHUNK_BYTES = 1 << 20
+
+# Optional extra pause between LLM batches; Gemini calls are already
+# throttled by the GEMINI_RPM limiter in gemini_client
+GEMINI_API_DELAY = int(os.getenv("GEMINI_API_DELAY_SECONDS", "0"))
+# Number of invoice texts sent to the LLM in a single prompt
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "8"))
+# Invoice texts are binned by length (chars) before batching: <8k, 8-16k, 16-24k, 24k+
+LLM_BIN_CHARS = 8000
+LLM_MAX_BIN = 3
+# Max invoices downloaded / OCR'd concurrently per vendor
+INVOICE_CONCURRENCY = int(os.getenv("INVOICE_CONCURRENCY", "8"))
+# Max vendors processed concurrently during a full sync (bounds Drive API QPS)
+VENDOR_CONCURRENCY = int(os.getenv("VENDOR_CONCURRENCY", "4"))
+# Retries (with backoff) for transient Drive/OCR failures before an invoice is skipped
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_RETRY_BASE_DELAY = 1.0
+# Rate limits and transient server errors; a plain 500 from our own OCR route is a bad PDF
+DRIVE_RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+OCR_RETRYABLE_STATUSES = frozenset({429, 502, 503, 504})
 
 
 def _ensure_folder(path: str) -> None:
-    if not os.path.exists(path):
-        os.makedirs(path)
+    os.makedirs(path, exist_ok=True)
 
 
-def _build_credentials(scopes: List[str], refresh_token: Optional[str]) -> Optional[Credentials]:
-    if not refresh_token:
-        logger.error("Refresh token missing; Drive access unavailable")
-        return None
+# Shared keep-alive client for Drive, OCR and email-service calls (created lazily)
+_http_client: Optional[httpx.AsyncClient] = None
 
-    creds = Credentials(
-        token=None,
-        refresh_token=refresh_token,
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=GOOGLE_CLIENT_ID,
-        client_secret=GOOGLE_CLIENT_SECRET,
-        scopes=scopes,
-    )
 
-    try:
-        creds.refresh(Request())
-    except Exception as exc:
-        logger.error("Failed to refresh Google credentials", exc_info=exc)
-        return None
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client (called on app shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# Refreshed credentials per (refresh token hash, scopes), reused until the access token
+# expires. LRU-bounded; expired entries and their locks are dropped as new ones arrive.
+CREDS_CACHE_MAX = int(os.getenv("CREDS_CACHE_MAX", "256"))
+_creds_cache: "OrderedDict[Tuple[str, Tuple[str, ...]], Credentials]" = OrderedDict()
+_creds_locks: Dict[Tuple[str, Tuple[str, ...]], asyncio.Lock] = {}
+# One token-endpoint transport per process, so refreshes reuse its HTTP session
+_auth_request = Request()
+
+
+async def _backoff(attempt: int, what: str, response: Optional[httpx.Response] = None) -> None:
+    delay = retry_delay(attempt, HTTP_RETRY_BASE_DELAY, response)
+    status = response.status_code if response is not None else "network error"
+    logger.warning(f"{what} failed ({status}). Retrying in {delay:.1f}s... (attempt {attempt + 1}/{HTTP_MAX_RETRIES})")
+    await asyncio.sleep(delay)
 
-    return creds
 
+async def _drive_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Send a Drive request, retrying transport errors and retryable statuses with backoff."""
+    client = _get_http_client()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+            await _backoff(attempt, f"Drive {method}")
+            continue
+        if response.status_code not in DRIVE_RETRYABLE_STATUSES or attempt == HTTP_MAX_RETRIES:
+            return response
+        await _backoff(attempt, f"Drive {method}", response)
+
+
+async def _build_credentials(scopes: List[str], refresh_token: Optional[str]) -> Optional[Credentials]:
+    if not refresh_token:
+        logger.error("Refresh token missing; Drive access unavailable")
+        return None
 
-async def _download_pdf(file_id: str, refresh_token: str) -> Optional[bytes]:
-    creds = _build_credentials(DRIVE_SCOPES, refresh_token)
+    key = (hashlib.sha256(refresh_token.encode()).hexdigest(), tuple(scopes))
+    # Per-key lock so concurrent downloads share a single token refresh
+    lock = _creds_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        creds = _creds_cache.get(key)
+        if creds is not None and creds.valid:
+            _creds_cache.move_to_end(key)
+            return creds
+
+        creds = Credentials(
+            token=None,
+            refresh_token=refresh_token,
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id=GOOGLE_CLIENT_ID,
+            client_secret=GOOGLE_CLIENT_SECRET,
+            scopes=scopes,
+        )
+
+        try:
+            await asyncio.to_thread(creds.refresh, _auth_request)
+        except Exception as exc:
+            _creds_cache.pop(key, None)
+            if _creds_locks.get(key) is lock:
+                del _creds_locks[key]
+            logger.error("Failed to refresh Google credentials", exc_info=exc)
+            return None
+
+        _creds_cache[key] = creds
+        _creds_cache.move_to_end(key)
+        _prune_credentials()
+        return creds
+
+
+def _prune_credentials() -> None:
+    """Drop expired credentials, then least recently used ones beyond CREDS_CACHE_MAX."""
+    stale = [key for key, creds in _creds_cache.items() if not creds.valid]
+    while len(_creds_cache) - len(stale) > CREDS_CACHE_MAX:
+        oldest = next(key for key in _creds_cache if key not in stale)
+        stale.append(oldest)
+    for key in stale:
+        del _creds_cache[key]
+        lock = _creds_locks.get(key)
+        # A held lock belongs to a refresh in progress, which will re-add the entry
+        if lock is not None and not lock.locked():
+            del _creds_locks[key]
+
+
+async def _download_pdf(file_id: str, refresh_token: str) -> Optional[Tuple[IO[bytes], str]]:
+    """Stream a PDF from Drive into a spooled temp file, hashing it on the way.
+
+    Returns (file, sha256 hex digest); the caller must close the file.
+    """
+    creds = await _build_credentials(DRIVE_SCOPES, refresh_token)
     if not creds:
         return None
 
-    url = f"https://www.googleapis.com/drive/v3/files/{file_id}?alt=media"
+    url = f"{DRIVE_FILES_URL}/{file_id}?alt=media"
     headers = {"Authorization": f"Bearer {creds.token}"}
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
+    spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+    client = _get_http_client()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        spool.seek(0)
+        spool.truncate()
+        digest = hashlib.sha256(usedforsecurity=False)
+        retry_response = None
         try:
-            response = await client.get(url, headers=headers)
-            if (response.status_code == 200):
-                return response.content
-            logger.warning("Drive download failed", extra={"file_id": file_id, "status": response.status_code})
+            async with client.stream("GET", url, headers=headers, timeout=60.0) as response:
+                if response.status_code == 200:
+                    async for chunk in response.aiter_bytes(PDF_CHUNK_BYTES):
+                        spool.write(chunk)
+                        digest.update(chunk)
+                    if spool.tell():
+                        spool.seek(0)
+                        return spool, digest.hexdigest()
+                    break
+                if response.status_code not in DRIVE_RETRYABLE_STATUSES or attempt == HTTP_MAX_RETRIES:
+                    logger.warning("Drive download failed", extra={"file_id": file_id, "status": response.status_code})
+                    break
+                retry_response = response
         except httpx.HTTPError as exc:
-            logger.error("HTTP error downloading from Drive", exc_info=exc, extra={"file_id": file_id})
+            if attempt == HTTP_MAX_RETRIES:
+                logger.error("HTTP error downloading from Drive", exc_info=exc, extra={"file_id": file_id})
+                break
+        await _backoff(attempt, "Drive download", retry_response)
+    spool.close()
     return None
 
 
-async def _run_invoice_ocr(filename: str, content: bytes) -> Optional[Dict]:
-    url = f"{OCR_INTERNAL_BASE_URL}/api/v1/invoice/extract"
-    files = {"file": (filename, content, "application/pdf")}
-
-    async with httpx.AsyncClient(timeout=120.0) as client:
+def _multipart_source(pdf_file: IO[bytes]):
+    """
+    What to hand httpx as the multipart file. httpx sizes file objects via
+    fileno(), which makes a SpooledTemporaryFile roll over to disk (a blocking
+    write on the event loop), so spools still in memory are sent as bytes.
+    """
+    pdf_file.seek(0)
+    if isinstance(pdf_file, tempfile.SpooledTemporaryFile) and not pdf_file._rolled:
+        return pdf_file.read()
+    return pdf_file
+
+
+async def _run_invoice_ocr(filename: str, pdf_file: IO[bytes]) -> Optional[str]:
+    """Extract raw PDF text via the OCR endpoint. Returns "" when the PDF has no text."""
+    url = f"{OCR_INTERNAL_BASE_URL}/api/v1/ocr/pdf_to_text"
+    client = _get_http_client()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        files = {"file": (filename, _multipart_source(pdf_file), "application/pdf")}
         try:
-            response = await client.post(url, files=files)
-            if response.status_code == 200:
-                return response.json()
+            response = await client.post(url, files=files, timeout=120.0)
+        except httpx.TransportError as exc:
+            if attempt == HTTP_MAX_RETRIES:
+                logger.error("HTTP error calling OCR endpoint", exc_info=exc, extra={"filename": filename})
+                return None
+            await _backoff(attempt, "OCR request")
+            continue
+        if response.status_code == 200:
+            return response.json().get("text", "")
+        if response.status_code == 400:
+            return ""
+        if response.status_code not in OCR_RETRYABLE_STATUSES or attempt == HTTP_MAX_RETRIES:
             logger.warning("OCR request failed", extra={"status": response.status_code, "filename": filename})
-        except httpx.HTTPError as exc:
-            logger.error("HTTP error calling OCR endpoint", exc_info=exc, extra={"filename": filename})
+            return None
+        await _backoff(attempt, "OCR request", response)
     return None
 
 
-async def _download_master_from_drive(folder_id: str, refresh_token: str) -> List[Dict]:
-    """Download existing master.json from Drive. Returns empty list if not found."""
+async def _list_master_files(headers: Dict[str, str], folder_id: str) -> List[Dict]:
+    """List master.json copies in a Drive folder."""
+    query = f"'{folder_id}' in parents and name='master.json' and trashed=false"
+    response = await _drive_request(
+        "GET", DRIVE_FILES_URL, params={"q": query, "fields": "files(id,md5Checksum)"}, headers=headers
+    )
+    response.raise_for_status()
+    return response.json().get("files", [])
+
+
+async def _download_master_from_drive(user_id: str, folder_id: str, refresh_token: str) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Download existing master.json from Drive.
+    Returns (records, drive file id); ([], None) if not found. The id is only
+    returned when exactly one master.json exists, so it can be updated in place.
+    The content comes from the MongoDB mirror when its md5Checksum still matches Drive.
+    """
     if not folder_id:
-        return []
+        return [], None
     
-    creds = _build_credentials(DRIVE_SCOPES, refresh_token)
+    creds = await _build_credentials(DRIVE_SCOPES, refresh_token)
     if not creds:
         logger.error("Failed to build credentials for Drive access")
-        return []
-    
-    service = build("drive", "v3", credentials=creds)
+        return [], None
     
-    # Search for master.json in the folder
-    query = f"'{folder_id}' in parents and name='master.json' and trashed=false"
+    headers = {"Authorization": f"Bearer {creds.token}"}
     try:
-        result = service.files().list(q=query, fields="files(id)").execute()
-        files = result.get("files", [])
-        
+        files = await _list_master_files(headers, folder_id)
         if not files:
-            return []
-        
-        # Download the file
+            return [], None
+
         file_id = files[0]["id"]
-        request = service.files().get_media(fileId=file_id)
-        
-        import io
-        file_buffer = io.BytesIO()
-        from googleapiclient.http import MediaIoBaseDownload
-        downloader = MediaIoBaseDownload(file_buffer, request)
-        
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        
-        file_buffer.seek(0)
-        master_data = json.load(file_buffer)
+        md5_checksum = files[0].get("md5Checksum")
+        mirror = await asyncio.to_thread(get_master_mirror, user_id, folder_id) if len(files) == 1 else None
+        if mirror and md5_checksum and mirror.get("md5Checksum") == md5_checksum:
+            content = bytes(mirror["content"])
+            logger.info("master.json unchanged on Drive; using mirrored copy")
+        else:
+            response = await _drive_request("GET", f"{DRIVE_FILES_URL}/{file_id}", params={"alt": "media"}, headers=headers)
+            response.raise_for_status()
+            content = response.content
+            if len(files) == 1:
+                await _mirror_master(user_id, folder_id, md5_checksum, content)
+        master_data = orjson.loads(content)
         logger.info(f"Loaded {len(master_data)} existing records from master.json")
-        return master_data if isinstance(master_data, list) else []
+        if not isinstance(master_data, list):
+            return [], None
+        return master_data, file_id if len(files) == 1 else None
         
     except Exception as exc:
         logger.warning(f"Failed to download master.json: {str(exc)[:100]}")
-        return []
+        return [], None
+
+
+async def _mirror_master(user_id: str, folder_id: str, md5_checksum: Optional[str], content: bytes) -> None:
+    """Best-effort refresh of the MongoDB master.json mirror."""
+    try:
+        await asyncio.to_thread(set_master_mirror, user_id, folder_id, md5_checksum, content)
+    except Exception as exc:
+        logger.warning(f"Failed to mirror master.json: {str(exc)[:100]}")
+
 
+def _multipart_related(metadata: Dict, content: bytes) -> Tuple[bytes, str]:
+    """Build a Drive multipart upload body (metadata + media). Returns (body, content type)."""
+    boundary = f"master-{uuid.uuid4().hex}"
+    body = b"".join([
+        f"--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n".encode(),
+        orjson.dumps(metadata),
+        f"\r\n--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode(),
+        content,
+        f"\r\n--{boundary}--".encode(),
+    ])
+    return body, f"multipart/related; boundary={boundary}"
 
-async def _upload_master_to_drive(folder_id: str, local_path: str, refresh_token: str) -> Optional[str]:
-    """Upload master.json to Drive and return the Drive path."""
+
+async def _upload_master_to_drive(
+    user_id: str, folder_id: str, master_bytes: bytes, refresh_token: str, master_file_id: Optional[str] = None
+) -> Optional[str]:
+    """
+    Upload master.json to Drive and return the Drive path.
+    Overwrites the file in place when its id is known; otherwise deletes
+    existing copies and creates a new one.
+    """
     if not folder_id:
         return None
 
-    creds = _build_credentials(DRIVE_SCOPES, refresh_token)
+    creds = await _build_credentials(DRIVE_SCOPES, refresh_token)
     if not creds:
         logger.error("Failed to build credentials for Drive upload")
         return None
 
-    service = build("drive", "v3", credentials=creds)
+    headers = {"Authorization": f"Bearer {creds.token}"}
 
-    # Remove existing master.json
-    query = f"'{folder_id}' in parents and name='master.json' and trashed=false"
     try:
-        result = service.files().list(q=query, fields="files(id)").execute()
-        existing_files = result.get("files", [])
-        if existing_files:
-            for item in existing_files:
-                service.files().delete(fileId=item["id"]).execute()
-    except Exception as exc:
-        logger.error(f"Failed to remove existing master.json: {str(exc)[:100]}")
-
-    metadata = {"name": "master.json", "parents": [folder_id]}
-    media = MediaFileUpload(local_path, mimetype="application/json")
+        if master_file_id:
+            response = await _drive_request(
+                "PATCH",
+                f"{DRIVE_UPLOAD_URL}/{master_file_id}",
+                params={"uploadType": "media", "fields": "id,md5Checksum"},
+                headers={**headers, "Content-Type": "application/json"},
+                content=master_bytes,
+            )
+            if response.status_code == 200:
+                logger.info(f"Uploaded master.json successfully")
+                await _mirror_master(user_id, folder_id, response.json().get("md5Checksum"), master_bytes)
+                return f"{folder_id}/master.json"
+            logger.warning(f"In-place master.json update failed ({response.status_code}), recreating")
 
-    try:
-        uploaded = service.files().create(body=metadata, media_body=media, fields="id").execute()
+        try:
+            existing_files = await _list_master_files(headers, folder_id)
+            await asyncio.gather(*(
+                _drive_request("DELETE", f"{DRIVE_FILES_URL}/{item['id']}", headers=headers) for item in existing_files
+            ))
+        except Exception as exc:
+            logger.error(f"Failed to remove existing master.json: {str(exc)[:100]}")
+
+        body, content_type = _multipart_related({"name": "master.json", "parents": [folder_id]}, master_bytes)
+        response = await _drive_request(
+            "POST",
+            DRIVE_UPLOAD_URL,
+            params={"uploadType": "multipart", "fields": "id,md5Checksum"},
+            headers={**headers, "Content-Type": content_type},
+            content=body,
+        )
+        response.raise_for_status()
         logger.info(f"Uploaded master.json successfully")
+        await _mirror_master(user_id, folder_id, response.json().get("md5Checksum"), master_bytes)
         return f"{folder_id}/master.json"
     except Exception as exc:
         logger.error(f"Failed to upload master.json: {str(exc)[:100]}")
         return None
 
 
+def _same_record(existing: Dict, enriched: Dict) -> bool:
+    """True when two master records differ at most in processed_at."""
+    return {k: v for k, v in existing.items() if k != "processed_at"} == {
+        k: v for k, v in enriched.items() if k != "processed_at"
+    }
+
+
+def _normalize_invoice(invoice: Dict) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    Pull identifiers and links out of an invoice listing entry.
+    Returns (item, None) for a processable PDF, else (None, skipped entry).
+    """
+    file_id = invoice.get("fileId") or invoice.get("file_id") or invoice.get("id")
+    file_name = invoice.get("fileName") or invoice.get("file_name") or invoice.get("name")
+    mime_type = invoice.get("mimeType")
+
+    if not file_id or not file_name:
+        return None, {"reason": "missing identifiers", "invoice": invoice}
+
+    if mime_type and mime_type != "application/pdf":
+        return None, {"reason": "unsupported mime", "invoice": invoice}
+
+    return {
+        "file_id": str(file_id),
+        "file_name": file_name,
+        "invoice": invoice,
+        "web_view_link": invoice.get("webViewLink") or invoice.get("web_view_link"),
+        "web_content_link": invoice.get("webContentLink") or invoice.get("web_content_link"),
+    }, None
+
+
 async def process_vendor_invoices(
     user_id: str,
     vendor_name: str,
@@ -178,15 +424,16 @@ async def process_vendor_invoices(
     vendor_folder_id: Optional[str] = None,
 ) -> Dict:
     """
-    Stateless OCR processing:
+    OCR processing for one vendor:
     1. Download existing master.json from Drive (or start fresh)
-    2. Process new invoices and append to master data
-    3. Upload updated master.json to Drive
-    4. Delete temporary files (no persistent cache)
+    2. Process new invoices and merge them into master data
+    3. Upload updated master.json to Drive (only when it changed)
     
-    Google Drive = single source of truth
-    MongoDB = processing status tracking
-    Local storage = temporary only (deleted after upload)
+    Google Drive = single source of truth (master.json)
+    MongoDB = processing status, plus caches: extractions by PDF hash + model
+    (ocr_cache) and the last master.json seen per folder (master_mirror)
+    Local storage = downloaded PDFs spooled only while processing, plus the
+    on-disk LLM response cache (llm_cache/, TTL-bound)
     """
     logger.info(f"[OCR] Processing vendor: {vendor_name} - {len(invoices)} invoices")
     
@@ -200,132 +447,272 @@ async def process_vendor_invoices(
             "skipped": [{"reason": "missing refresh token", "invoice": None}],
         }
     
-    from app.db import get_db
-    
-    # Step 1: Download existing master.json from Drive (stateless!)
-    master_records = await _download_master_from_drive(invoice_folder_id, refresh_token)
-    master_index = {str(entry.get("drive_file_id")): entry for entry in master_records if entry.get("drive_file_id")}
-
     processed, skipped = [], []
+    pending: List[Dict] = []
+    # drive_file_id -> error message, written to MongoDB in one bulk call
+    failures: Dict[str, str] = {}
 
     # Get database instance to check document status
-    db = get_db()
+    db = await asyncio.to_thread(get_db)
     docs_collection = db["documents"]
 
+    # Cheap validation first, so only well-formed PDFs reach the DB/Drive stages
+    candidates: List[Dict] = []
     for invoice in invoices:
-        file_id = str(invoice.get("fileId") or invoice.get("file_id") or invoice.get("id"))
-        file_name = invoice.get("fileName") or invoice.get("file_name") or invoice.get("name")
-        mime_type = invoice.get("mimeType")
-        web_view_link = invoice.get("webViewLink") or invoice.get("web_view_link")
-        web_content_link = invoice.get("webContentLink") or invoice.get("web_content_link")
-
-        if not file_id or not file_name:
-            skipped.append({"reason": "missing identifiers", "invoice": invoice})
+        item, skip = _normalize_invoice(invoice)
+        if skip is not None:
+            skipped.append(skip)
+        else:
+            candidates.append(item)
+
+    # Check DB status - this is the source of truth! One $in query for the whole vendor
+    status_by_id: Dict[str, str] = {}
+    if candidates:
+        docs = await asyncio.to_thread(
+            lambda: list(docs_collection.find(
+                {"userId": user_id, "driveFileId": {"$in": [item["file_id"] for item in candidates]}},
+                {"_id": 0, "driveFileId": 1, "ocrStatus": 1},
+            ))
+        )
+        status_by_id = {doc["driveFileId"]: doc.get("ocrStatus", "PENDING") for doc in docs}
+
+    eligible: List[Dict] = []
+    for item in candidates:
+        file_id = item["file_id"]
+        file_name = item["file_name"]
+        ocr_status = status_by_id.get(file_id)
+
+        if ocr_status is None:
+            logger.warning(f"[OCR] Document not in DB: {file_name}")
+        elif ocr_status == "COMPLETED":
+            skipped.append({"reason": "already completed (DB)", "invoice": item["invoice"], "file_id": file_id})
             continue
-
-        if mime_type and mime_type != "application/pdf":
-            skipped.append({"reason": "unsupported mime", "invoice": invoice})
+        elif ocr_status == "PROCESSING":
+            skipped.append({"reason": "already processing", "invoice": item["invoice"], "file_id": file_id})
             continue
+        else:
+            logger.info(f"[OCR] Processing: {file_name}")
+        eligible.append(item)
 
-        # Check DB status - this is the source of truth!
-        doc_in_db = docs_collection.find_one({
+    if not eligible:
+        # Nothing new for this vendor: no Drive I/O at all
+        logger.info(f"[OCR] ✓ {vendor_name}: 0 processed, {len(skipped)} skipped")
+        return {
             "userId": user_id,
-            "driveFileId": file_id
-        })
-
-        if doc_in_db:
-            ocr_status = doc_in_db.get("ocrStatus", "PENDING")
-            
-            if ocr_status == "COMPLETED":
-                skipped.append({"reason": "already completed (DB)", "invoice": invoice, "file_id": file_id})
-                continue
-            
-            if ocr_status == "PROCESSING":
-                skipped.append({"reason": "already processing", "invoice": invoice, "file_id": file_id})
-                continue
-            
-            logger.info(f"[OCR] Processing: {file_name}")
-        else:
-            logger.warning(f"[OCR] Document not in DB: {file_name}")
+            "vendorName": vendor_name,
+            "invoiceFolderId": invoice_folder_id,
+            "processed": processed,
+            "skipped": skipped,
+        }
 
-        # Update MongoDB: OCR processing started
-        update_ocr_status(user_id, file_id, "PROCESSING")
+    # Step 1: Download existing master.json from Drive (stateless!), overlapped with OCR below
+    master_task = asyncio.create_task(_download_master_from_drive(user_id, invoice_folder_id, refresh_token))
 
-        # Download PDF from Drive
-        pdf_bytes = await _download_pdf(file_id, refresh_token)
-        if not pdf_bytes:
-            logger.error(f"[OCR] Download failed: {file_name}")
-            update_ocr_status(user_id, file_id, "FAILED", ocr_error="Failed to download PDF from Drive")
-            skipped.append({"reason": "download failed", "invoice": invoice, "file_id": file_id})
-            continue
+    # Ids whose final status has been written; anything else is still PROCESSING
+    finalized: set = set()
+    try:
+        # Update MongoDB: OCR processing started (one write for the whole vendor).
+        # Inside the try so a failed write still cancels the master download.
+        await asyncio.to_thread(
+            update_ocr_statuses_bulk, user_id, [item["file_id"] for item in eligible], "PROCESSING"
+        )
+
+        semaphore = asyncio.Semaphore(INVOICE_CONCURRENCY)
+        # Cached extractions are only valid for the model that produced them
+        model = active_model()
+
+        async def _prepare_invoice(item: Dict) -> Optional[Dict]:
+            """Download and extract text for one invoice, filling in item.
+
+            Returns a skipped entry on failure, None on success.
+            """
+            file_id = item["file_id"]
+            file_name = item["file_name"]
+
+            async with semaphore:
+                # Download PDF from Drive
+                downloaded = await _download_pdf(file_id, refresh_token)
+                if downloaded is None:
+                    logger.error(f"[OCR] Download failed: {file_name}")
+                    failures[file_id] = "Failed to download PDF from Drive"
+                    return {"reason": "download failed", "invoice": item["invoice"], "file_id": file_id}
+
+                pdf_file, item["sha256"] = downloaded
+
+                # Byte-identical PDF already extracted: skip OCR and the LLM
+                try:
+                    cached_payload = await asyncio.to_thread(get_ocr_cache, item["sha256"], model)
+                except Exception as exc:
+                    logger.warning(f"[OCR] OCR cache lookup failed: {str(exc)[:100]}")
+                    cached_payload = None
+                if cached_payload is not None:
+                    pdf_file.close()
+                    logger.info(f"[OCR] Cache hit (sha256): {file_name}")
+                    item["payload"] = dict(cached_payload)
+                    return None
+
+                # Run OCR (text only; structured extraction is batched below)
+                with pdf_file:
+                    extracted_text = await _run_invoice_ocr(file_name, pdf_file)
+                if not extracted_text:
+                    error_msg = "No text found in the PDF." if extracted_text == "" else "OCR extraction failed"
+                    logger.error(f"[OCR] Failed: {file_name} - {error_msg}")
+                    failures[file_id] = error_msg
+                    return {"reason": "ocr failed", "invoice": item["invoice"], "file_id": file_id, "error": error_msg}
+
+            item["text"] = extracted_text
+            return None
+
+        outcomes = await asyncio.gather(*(_prepare_invoice(item) for item in eligible), return_exceptions=True)
+        for item, outcome in zip(eligible, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"[OCR] Unexpected error preparing {item['file_name']}: {str(outcome)[:100]}")
+                failures[item["file_id"]] = str(outcome)
+                skipped.append({"reason": "processing error", "invoice": item["invoice"], "file_id": item["file_id"], "error": str(outcome)})
+            elif outcome:
+                skipped.append(outcome)
+            else:
+                pending.append(item)
+
+        # Batch LLM extraction for invoices not served from the PDF hash cache.
+        # Texts are grouped into length bins so each prompt holds similar-sized
+        # invoices; bins are extracted concurrently (the Gemini limiter paces calls).
+        bins: Dict[int, List[Dict]] = defaultdict(list)
+        for item in pending:
+            if "payload" not in item:
+                bins[min(LLM_MAX_BIN, len(item["text"]) // LLM_BIN_CHARS)].append(item)
+
+        async def _extract_bin(bin_items: List[Dict]) -> None:
+            for start in range(0, len(bin_items), LLM_BATCH_SIZE):
+                batch = bin_items[start:start + LLM_BATCH_SIZE]
+                payloads = await extract_invoice_jsons_batch([item["text"] for item in batch], LLM_BATCH_SIZE)
+
+                # Rate limiting: Add delay AFTER EACH LLM call
+                if GEMINI_API_DELAY > 0:
+                    await asyncio.sleep(GEMINI_API_DELAY)
+
+                for item, ocr_payload in zip(batch, payloads):
+                    item["payload"] = ocr_payload
+
+        extract_items = [item for bin_items in bins.values() for item in bin_items]
+        await asyncio.gather(*(_extract_bin(bin_items) for bin_items in bins.values()))
+
+        # Remember successful extractions by PDF hash (shared across instances and restarts)
+        new_cache_entries = {
+            item["sha256"]: item["payload"]
+            for item in extract_items
+            if item["payload"] and "error" not in item["payload"]
+        }
+        if new_cache_entries:
+            try:
+                await asyncio.to_thread(set_ocr_cache_bulk, new_cache_entries, model)
+            except Exception as exc:
+                logger.warning(f"[OCR] OCR cache write failed: {str(exc)[:100]}")
+
+        # One timestamp for the whole merge; records from a single run share processed_at
+        processed_at = datetime.now(timezone.utc).isoformat()
+        enriched_records: List[Dict] = []
+        for item in pending:
+            ocr_payload = item["payload"]
+            file_id = item["file_id"]
+            file_name = item["file_name"]
+
+            # Check if extraction failed
+            if not ocr_payload or "error" in ocr_payload:
+                error_msg = ocr_payload.get("error") if ocr_payload else "OCR extraction failed"
+                logger.error(f"[OCR] Failed: {file_name} - {error_msg}")
+                failures[file_id] = error_msg
+                skipped.append({"reason": "ocr failed", "invoice": item["invoice"], "file_id": file_id, "error": error_msg})
+                continue
 
-        # Run OCR
-        ocr_payload = await _run_invoice_ocr(file_name, pdf_bytes)
-        
-        # Rate limiting: Add delay AFTER EACH OCR attempt
-        if GEMINI_API_DELAY > 0:
-            await asyncio.sleep(GEMINI_API_DELAY)
-        
-        # Check if OCR failed
-        if not ocr_payload or "error" in ocr_payload:
-            error_msg = ocr_payload.get("error") if ocr_payload else "OCR extraction failed"
-            logger.error(f"[OCR] Failed: {file_name} - {error_msg}")
-            update_ocr_status(user_id, file_id, "FAILED", ocr_error=error_msg)
-            skipped.append({"reason": "ocr failed", "invoice": invoice, "file_id": file_id, "error": error_msg})
-            continue
+            # Enrich OCR result with metadata
+            enriched = dict(ocr_payload)
+            enriched.update({
+                "drive_file_id": file_id,
+                "file_name": file_name,
+                "vendor_name": vendor_name,
+                "sha256": item["sha256"],
+                "processed_at": processed_at,
+            })
+            if item["web_view_link"]:
+                enriched["web_view_link"] = item["web_view_link"]
+            if item["web_content_link"]:
+                enriched["web_content_link"] = item["web_content_link"]
+            enriched_records.append(enriched)
+
+        # The existing master is only needed (and parsed) when there is something to merge
+        master_records: List[Dict] = []
+        master_file_id = None
+        if enriched_records:
+            master_records, master_file_id = await master_task
+        else:
+            master_task.cancel()
 
-        # Enrich OCR result with metadata
-        enriched = dict(ocr_payload)
-        enriched.update({
-            "drive_file_id": file_id,
-            "file_name": file_name,
-            "vendor_name": vendor_name,
-            "processed_at": datetime.now(timezone.utc).isoformat(),
-        })
-        if web_view_link:
-            enriched["web_view_link"] = web_view_link
-        if web_content_link:
-            enriched["web_content_link"] = web_content_link
-
-        # Update or append to master data (avoid duplicates by drive_file_id)
-        if file_id in master_index:
-            idx = next((i for i, r in enumerate(master_records) if r.get("drive_file_id") == file_id), None)
-            if idx is not None:
-                master_records[idx] = enriched
+        # drive_file_id -> position in master_records, built in one pass (replace instead of duplicating)
+        master_pos = {
+            str(entry["drive_file_id"]): position
+            for position, entry in enumerate(master_records)
+            if entry.get("drive_file_id")
+        }
+
+        master_changed = False
+        for enriched in enriched_records:
+            file_id = enriched["drive_file_id"]
+
+            # Update or append to master data (avoid duplicates by drive_file_id)
+            position = master_pos.get(file_id)
+            if position is not None:
+                # Re-extracting an unchanged invoice keeps the existing record as-is
+                if not _same_record(master_records[position], enriched):
+                    master_records[position] = enriched
+                    master_changed = True
             else:
+                master_changed = True
+                master_pos[file_id] = len(master_records)
                 master_records.append(enriched)
-        else:
-            master_records.append(enriched)
-        
-        master_index[file_id] = enriched
-        processed.append(file_id)
-        logger.info(f"[OCR] ✓ {file_name}")
-
-    # Step 2: Upload updated master.json to Drive
-    master_json_path = None
-    if processed:
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, encoding='utf-8') as temp_file:
-            json.dump(master_records, temp_file, indent=4)
-            temp_path = temp_file.name
-        
-        try:
-            master_json_path = await _upload_master_to_drive(invoice_folder_id, temp_path, refresh_token)
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        except Exception as e:
-            logger.error(f"[OCR] Upload/cleanup failed: {str(e)[:100]}")
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
-    # Update MongoDB for all processed invoices
-    if processed:
-        for file_id in processed:
-            update_ocr_status(
+            processed.append(file_id)
+            logger.info(f"[OCR] ✓ {enriched['file_name']}")
+
+        # Step 2: Upload updated master.json to Drive
+        master_json_path = None
+        if processed and not master_changed:
+            logger.info(f"[OCR] master.json unchanged for {vendor_name}; skipping upload")
+            master_json_path = f"{invoice_folder_id}/master.json" if invoice_folder_id else None
+        elif processed:
+            # Compact output: master.json is only machine-read and grows with every invoice
+            master_bytes = orjson.dumps(master_records)
+            master_json_path = await _upload_master_to_drive(
+                user_id, invoice_folder_id, master_bytes, refresh_token, master_file_id
+            )
+
+        # Update MongoDB for all failed and processed invoices in bulk
+        if failures:
+            await asyncio.to_thread(mark_ocr_failures_bulk, user_id, failures)
+            finalized.update(failures)
+        if processed:
+            await asyncio.to_thread(
+                update_ocr_statuses_bulk,
                 user_id=user_id,
-                drive_file_id=file_id,
+                drive_file_ids=processed,
                 ocr_status="COMPLETED",
                 master_json_path=master_json_path,
             )
+            finalized.update(processed)
+    except BaseException as exc:
+        # Never leave invoices stuck in PROCESSING: later syncs skip them and retry only picks FAILED
+        master_task.cancel()
+        error_msg = f"Unexpected error: {str(exc)[:200]}"
+        leftover = {
+            item["file_id"]: failures.get(item["file_id"], error_msg)
+            for item in eligible
+            if item["file_id"] not in finalized
+        }
+        logger.error(f"[OCR] {vendor_name}: aborted, marking {len(leftover)} invoices FAILED - {str(exc)[:100]}")
+        try:
+            await asyncio.to_thread(mark_ocr_failures_bulk, user_id, leftover)
+        except Exception as mark_exc:
+            logger.error(f"[OCR] Failed to mark invoices FAILED: {str(mark_exc)[:100]}")
+        raise
 
     logger.info(f"[OCR] ✓ {vendor_name}: {len(processed)} processed, {len(skipped)} skipped")
     
@@ -346,16 +733,19 @@ async def process_all_invoices(user_id: str, refresh_token: str) -> List[Dict]:
         logger.error("Refresh token required for full sync", extra={"user_id": user_id})
         return results
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        vendor_resp = await client.get(f"{EMAIL_BASE}/api/v1/drive/users/{user_id}/vendors")
-        if vendor_resp.status_code != 200:
-            logger.error("Failed to fetch vendor list", extra={"user_id": user_id, "status": vendor_resp.status_code})
-            return results
+    client = _get_http_client()
+    vendor_resp = await client.get(f"{EMAIL_BASE}/api/v1/drive/users/{user_id}/vendors")
+    if vendor_resp.status_code != 200:
+        logger.error("Failed to fetch vendor list", extra={"user_id": user_id, "status": vendor_resp.status_code})
+        return results
 
-        for vendor in vendor_resp.json().get("vendors", []):
-            vendor_folder_id = vendor.get("id")
-            vendor_name = vendor.get("name", "Unknown Vendor")
+    semaphore = asyncio.Semaphore(VENDOR_CONCURRENCY)
 
+    async def _process_vendor(vendor: Dict) -> Optional[Dict]:
+        vendor_folder_id = vendor.get("id")
+        vendor_name = vendor.get("name", "Unknown Vendor")
+
+        async with semaphore:
             invoice_resp = await client.get(
                 f"{EMAIL_BASE}/api/v1/drive/users/{user_id}/vendors/{vendor_folder_id}/invoices"
             )
@@ -364,10 +754,10 @@ async def process_all_invoices(user_id: str, refresh_token: str) -> List[Dict]:
                     "Failed to fetch invoices",
                     extra={"user_id": user_id, "vendor_id": vendor_folder_id, "status": invoice_resp.status_code},
                 )
-                continue
+                return None
 
             invoice_payload = invoice_resp.json()
-            summary = await process_vendor_invoices(
+            return await process_vendor_invoices(
                 user_id=user_id,
                 vendor_name=vendor_name,
                 invoice_folder_id=invoice_payload.get("invoiceFolderId"),
@@ -375,6 +765,13 @@ async def process_all_invoices(user_id: str, refresh_token: str) -> List[Dict]:
                 vendor_folder_id=vendor_folder_id,
                 refresh_token=refresh_token,
             )
+
+    vendors = vendor_resp.json().get("vendors", [])
+    summaries = await asyncio.gather(*(_process_vendor(vendor) for vendor in vendors), return_exceptions=True)
+    for vendor, summary in zip(vendors, summaries):
+        if isinstance(summary, BaseException):
+            logger.error(f"[OCR] Vendor {vendor.get('name')} failed: {str(summary)[:100]}")
+        elif summary is not None:
             results.append(summary)
 
     logger.info("Full invoice sync complete", extra={"user_id": user_id, "vendors": len(results)})
@@ -0,0 +1,74 @@
+"""
+Response cache for LLM invoice extraction.
+Keyed by model + normalized invoice text so reprocessed or duplicate
+invoices skip the LLM round-trip.
+"""
+import hashlib
+import logging
+import os
+import re
+from typing import List, Optional, Tuple
+
+from diskcache import Cache
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "llm_cache")
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_cache: Optional[Cache] = None
+
+
+def _get_cache() -> Optional[Cache]:
+    """Get the on-disk cache (lazy initialization). None when caching is disabled."""
+    global _cache
+    if LLM_CACHE_TTL_SECONDS <= 0:
+        return None
+    if _cache is None:
+        _cache = Cache(LLM_CACHE_DIR)
+        logger.info(f"LLM response cache at: {LLM_CACHE_DIR}")
+    return _cache
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so OCR layout noise shares a key. Case is kept: invoice ids are case-sensitive."""
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}:{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def get_cached(key: str) -> Optional[dict]:
+    cache = _get_cache()
+    if cache is None:
+        return None
+    try:
+        return cache.get(key)
+    except Exception as exc:
+        logger.warning(f"LLM cache read failed: {exc}")
+        return None
+
+
+def set_cached(key: str, result: dict) -> None:
+    """Store a successful extraction; error results are never cached."""
+    cache = _get_cache()
+    if cache is None or not result or "error" in result:
+        return
+    try:
+        cache.set(key, result, expire=LLM_CACHE_TTL_SECONDS)
+    except Exception as exc:
+        logger.warning(f"LLM cache write failed: {exc}")
+
+
+def get_cached_many(keys: List[str]) -> List[Optional[dict]]:
+    """get_cached for several keys (blocking; call via asyncio.to_thread)."""
+    return [get_cached(key) for key in keys]
+
+
+def set_cached_many(entries: List[Tuple[str, dict]]) -> None:
+    """set_cached for several (key, result) pairs (blocking; call via asyncio.to_thread)."""
+    for key, result in entries:
+        set_cached(key, result)
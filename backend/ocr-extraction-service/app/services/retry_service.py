@@ -2,53 +2,165 @@
 Retry service for handling failed invoice processing operations.
 Now uses MongoDB for status tracking instead of file-based storage.
 """
+import asyncio
+import hashlib
 import logging
-from typing import Dict, List, Optional
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 
-from app.db import get_db, update_ocr_status
-from app.services.invoice_processor import process_vendor_invoices
+from app.db import delete_master_mirrors, get_db, update_ocr_statuses_bulk
+from app.services.invoice_processor import VENDOR_CONCURRENCY, process_vendor_invoices
 
 logger = logging.getLogger(__name__)
 
+# Exponential backoff between retries of the same invoice: base * 2**(failures - 1), capped, jittered
+RETRY_BACKOFF_BASE_SECONDS = float(os.getenv("RETRY_BACKOFF_BASE_SECONDS", "30"))
+RETRY_BACKOFF_CAP_SECONDS = float(os.getenv("RETRY_BACKOFF_CAP_SECONDS", "3600"))
+
+# OCR statuses that imply at least one OCR attempt was made
+OCR_ATTEMPTED_STATUSES = frozenset({"COMPLETED", "FAILED"})
+
+# Fields read when building per-invoice status rows
+STATUS_PROJECTION = {
+    "_id": 0,
+    "driveFileId": 1,
+    "fileName": 1,
+    "vendorName": 1,
+    "vendorFolderId": 1,
+    "invoiceFolderId": 1,
+    "webViewLink": 1,
+    "ocrStatus": 1,
+    "ocrError": 1,
+    "indexed": 1,
+    "createdAt": 1,
+    "updatedAt": 1,
+    "ocrCompletedAt": 1,
+}
+
+# Fields needed to rebuild vendor retry batches from failed documents
+RETRY_PROJECTION = {
+    "_id": 0,
+    "driveFileId": 1,
+    "fileName": 1,
+    "vendorName": 1,
+    "vendorFolderId": 1,
+    "invoiceFolderId": 1,
+    "webViewLink": 1,
+    "ocrFailureCount": 1,
+    "lastFailedAt": 1,
+}
+
+
+async def _documents():
+    """The shared documents collection (get_db may connect on first use, so it runs in a thread)."""
+    db = await asyncio.to_thread(get_db)
+    return db["documents"]
+
+
+def _status_query(user_id: str, vendor_name: Optional[str] = None, ocr_status: Optional[str] = None) -> Dict:
+    """Filter on userId plus optional vendorName/ocrStatus (matches the compound status index)."""
+    query = {"userId": user_id}
+    if vendor_name:
+        query["vendorName"] = vendor_name
+    if ocr_status:
+        query["ocrStatus"] = ocr_status
+    return query
+
+
+def _backoff_jitter(drive_file_id: str, failures: int) -> float:
+    """Jitter factor in [0.5, 1.5), fixed per (invoice, failure) so repeated calls agree."""
+    digest = hashlib.blake2b(f"{drive_file_id}:{failures}".encode(), digest_size=8).digest()
+    return 0.5 + int.from_bytes(digest, "big") / 2 ** 64
+
+
+def _split_backoff(failed_docs: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Split failed documents into (ready, backoff_pending). A document stays
+    pending until its jittered backoff since lastFailedAt has elapsed.
+    """
+    # pymongo returns naive UTC datetimes
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    ready, pending = [], []
+    for doc in failed_docs:
+        last_failed_at = doc.get("lastFailedAt")
+        failures = doc.get("ocrFailureCount") or 0
+        if last_failed_at is None or failures == 0:
+            ready.append(doc)
+            continue
+        backoff = min(RETRY_BACKOFF_CAP_SECONDS, RETRY_BACKOFF_BASE_SECONDS * 2 ** (failures - 1))
+        backoff *= _backoff_jitter(str(doc.get("driveFileId")), failures)
+        remaining = backoff - (now - last_failed_at).total_seconds()
+        if remaining <= 0:
+            ready.append(doc)
+        else:
+            pending.append({
+                "drive_file_id": doc.get("driveFileId"),
+                "file_name": doc.get("fileName"),
+                "vendor_name": doc.get("vendorName"),
+                "failure_count": failures,
+                "retry_in_seconds": round(remaining),
+            })
+    return ready, pending
+
+
+def _find_all(collection, query: Dict, projection: Dict) -> List[Dict]:
+    """Run a find and drain the cursor (blocking; call via asyncio.to_thread)."""
+    return list(collection.find(query, projection))
+
+
+def _find_page(collection, query: Dict, projection: Dict, skip: int, limit: Optional[int]) -> List[Dict]:
+    """Like _find_all, but a stable (_id-ordered) page when skip or limit is given."""
+    if limit is None and not skip:
+        return _find_all(collection, query, projection)
+    cursor = collection.find(query, projection).sort("_id", 1).skip(skip)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return list(cursor)
+
+
+def _count_by_status(collection, query: Dict) -> Dict[str, int]:
+    """Count matching documents per ocrStatus server-side (blocking; call via asyncio.to_thread)."""
+    pipeline = [
+        {"$match": query},
+        {"$group": {"_id": "$ocrStatus", "count": {"$sum": 1}}}
+    ]
+    return {item["_id"] or "PENDING": item["count"] for item in collection.aggregate(pipeline)}
+
 
 async def get_processing_status(
     user_id: str,
     vendor_name: Optional[str] = None,
-    status_filter: Optional[str] = None
+    status_filter: Optional[str] = None,
+    skip: int = 0,
+    limit: Optional[int] = None,
 ) -> Dict:
     """
     Get processing status for invoices from MongoDB.
     Returns structure compatible with frontend InvoiceStatusResponse.
+    Counts always cover every matching invoice; with a limit, by_status only
+    holds that page of rows (limit=0 returns counts only). Timestamps are left
+    as datetimes; the route's orjson serialization renders them as ISO 8601.
     """
     try:
-        db = get_db()
-        docs = db["documents"]
+        docs = await _documents()
+        query = _status_query(user_id, vendor_name, status_filter)
         
-        query = {"userId": user_id}
-        if vendor_name:
-            query["vendorName"] = vendor_name
-        if status_filter:
-            query["ocrStatus"] = status_filter
+        if limit == 0:
+            summary, documents = await asyncio.to_thread(_count_by_status, docs, query), []
+        else:
+            summary, documents = await asyncio.gather(
+                asyncio.to_thread(_count_by_status, docs, query),
+                asyncio.to_thread(_find_page, docs, query, STATUS_PROJECTION, skip, limit),
+            )
         
-        documents = list(docs.find(query))
-        
-        # Group by status for summary - use ocrStatus as the key
-        by_status = {}
+        # Group rows by ocrStatus in one pass (counts come from the aggregation above)
+        by_status: Dict[str, List[Dict]] = defaultdict(list)
         for doc in documents:
             status = doc.get("ocrStatus", "PENDING")
-            if status not in by_status:
-                by_status[status] = []
-            
-            # Build errors array from ocrError if present
-            errors = []
-            if doc.get("ocrError"):
-                errors.append({
-                    "phase": "ocr",
-                    "message": doc.get("ocrError"),
-                    "code": "OCR_ERROR",
-                    "retryable": True,
-                    "timestamp": doc.get("updatedAt").isoformat() if doc.get("updatedAt") else None
-                })
+            ocr_error = doc.get("ocrError")
+            updated_at = doc.get("updatedAt")
             
             by_status[status].append({
                 "user_id": user_id,
@@ -56,12 +168,19 @@ async def get_processing_status(
                 "drive_file_id": doc.get("driveFileId"),
                 "file_name": doc.get("fileName"),
                 "status": status,  # Frontend expects 'status' not 'ocr_status'
-                "ocr_attempt_count": 1 if status in ["COMPLETED", "FAILED"] else 0,
+                "ocr_attempt_count": 1 if status in OCR_ATTEMPTED_STATUSES else 0,
                 "chat_attempt_count": 1 if doc.get("indexed") else 0,
-                "errors": errors,
-                "created_at": doc.get("createdAt").isoformat() if doc.get("createdAt") else None,
-                "updated_at": doc.get("updatedAt").isoformat() if doc.get("updatedAt") else None,
-                "ocr_completed_at": doc.get("ocrCompletedAt").isoformat() if doc.get("ocrCompletedAt") else None,
+                # Build errors array from ocrError if present
+                "errors": [{
+                    "phase": "ocr",
+                    "message": ocr_error,
+                    "code": "OCR_ERROR",
+                    "retryable": True,
+                    "timestamp": updated_at
+                }] if ocr_error else [],
+                "created_at": doc.get("createdAt"),
+                "updated_at": updated_at,
+                "ocr_completed_at": doc.get("ocrCompletedAt"),
                 "web_view_link": doc.get("webViewLink"),
                 "vendor_folder_id": doc.get("vendorFolderId"),
                 "invoice_folder_id": doc.get("invoiceFolderId"),
@@ -71,9 +190,9 @@ async def get_processing_status(
             "success": True,
             "user_id": user_id,
             "vendor_name": vendor_name,
-            "total_count": len(documents),
-            "by_status": by_status,
-            "summary": {status: len(items) for status, items in by_status.items()}
+            "total_count": sum(summary.values()),
+            "by_status": dict(by_status),
+            "summary": summary
         }
     except Exception as e:
         logger.error(f"Failed to get processing status: {e}", exc_info=True)
@@ -89,19 +208,18 @@ async def retry_failed_invoices(
 ) -> Dict:
     """
     Retry failed invoice processing operations.
+    Invoices that failed recently are left for later (reported under
+    backoff_pending) so repeated calls don't hammer Drive/OCR.
     """
     try:
-        db = get_db()
-        docs = db["documents"]
+        docs = await _documents()
         
         # Query failed documents
-        query = {"userId": user_id, "ocrStatus": "FAILED"}
-        if vendor_name:
-            query["vendorName"] = vendor_name
+        query = _status_query(user_id, vendor_name, "FAILED")
         if drive_file_ids:
             query["driveFileId"] = {"$in": drive_file_ids}
         
-        failed_docs = list(docs.find(query))
+        failed_docs = await asyncio.to_thread(_find_all, docs, query, RETRY_PROJECTION)
         
         if not failed_docs:
             return {
@@ -113,6 +231,20 @@ async def retry_failed_invoices(
                 "results": []
             }
         
+        total_failed = len(failed_docs)
+        failed_docs, backoff_pending = _split_backoff(failed_docs)
+        if not failed_docs:
+            return {
+                "success": True,
+                "message": f"All {total_failed} failed invoices are backing off; try again later",
+                "user_id": user_id,
+                "vendor_name": vendor_name,
+                "total_failed": total_failed,
+                "retried": 0,
+                "results": [],
+                "backoff_pending": backoff_pending
+            }
+        
         # Group by vendor for batch processing
         by_vendor = {}
         for doc in failed_docs:
@@ -131,53 +263,62 @@ async def retry_failed_invoices(
                 "webViewLink": doc.get("webViewLink")
             })
         
-        # Retry each vendor batch
-        results = []
-        total_retried = 0
-        
-        for vendor, batch_data in by_vendor.items():
-            try:
-                logger.info(f"Retrying {len(batch_data['invoices'])} invoices for vendor {vendor}")
-                
-                # Reset status to PENDING before retry
-                for inv in batch_data["invoices"]:
-                    update_ocr_status(user_id, inv["fileId"], "PENDING")
-                
-                summary = await process_vendor_invoices(
-                    user_id=user_id,
-                    vendor_name=vendor,
-                    invoice_folder_id=batch_data["invoice_folder_id"],
-                    invoices=batch_data["invoices"],
-                    vendor_folder_id=batch_data["vendor_folder_id"],
-                    refresh_token=refresh_token
-                )
-                
-                total_retried += len(batch_data["invoices"])
-                results.append({
-                    "vendor": vendor,
-                    "status": "completed",
-                    "processed": len(summary.get("processed", [])),
-                    "skipped": len(summary.get("skipped", []))
-                })
-                
-                logger.info(f"Retry completed for vendor {vendor}")
-                
-            except Exception as e:
-                logger.error(f"Retry failed for vendor {vendor}: {e}", exc_info=True)
-                results.append({
-                    "vendor": vendor,
-                    "status": "failed",
-                    "error": str(e)
-                })
+        # Reset status to PENDING before retry (one write for every vendor batch)
+        await asyncio.to_thread(
+            update_ocr_statuses_bulk, user_id, [doc.get("driveFileId") for doc in failed_docs], "PENDING"
+        )
+        
+        # Retry vendor batches concurrently, bounded like a full sync (Drive API QPS)
+        semaphore = asyncio.Semaphore(VENDOR_CONCURRENCY)
+        
+        async def _retry_vendor(vendor: str, batch_data: Dict) -> Dict:
+            async with semaphore:
+                try:
+                    logger.info(f"Retrying {len(batch_data['invoices'])} invoices for vendor {vendor}")
+                    
+                    summary = await process_vendor_invoices(
+                        user_id=user_id,
+                        vendor_name=vendor,
+                        invoice_folder_id=batch_data["invoice_folder_id"],
+                        invoices=batch_data["invoices"],
+                        vendor_folder_id=batch_data["vendor_folder_id"],
+                        refresh_token=refresh_token
+                    )
+                    
+                    logger.info(f"Retry completed for vendor {vendor}")
+                    return {
+                        "vendor": vendor,
+                        "status": "completed",
+                        "processed": len(summary.get("processed", [])),
+                        "skipped": len(summary.get("skipped", []))
+                    }
+                    
+                except Exception as e:
+                    logger.error(f"Retry failed for vendor {vendor}: {e}", exc_info=True)
+                    return {
+                        "vendor": vendor,
+                        "status": "failed",
+                        "error": str(e)
+                    }
+        
+        results = await asyncio.gather(
+            *(_retry_vendor(vendor, batch_data) for vendor, batch_data in by_vendor.items())
+        )
+        total_retried = sum(
+            len(batch_data["invoices"])
+            for result, batch_data in zip(results, by_vendor.values())
+            if result["status"] == "completed"
+        )
         
         return {
             "success": True,
             "message": f"Retried {total_retried} invoices across {len(by_vendor)} vendors",
             "user_id": user_id,
             "vendor_name": vendor_name,
-            "total_failed": len(failed_docs),
+            "total_failed": total_failed,
             "retried": total_retried,
-            "results": results
+            "results": results,
+            "backoff_pending": backoff_pending
         }
         
     except Exception as e:
@@ -185,29 +326,18 @@ async def retry_failed_invoices(
         return {"success": False, "error": str(e), "user_id": user_id}
 
 
-def get_status_summary(user_id: str, vendor_name: Optional[str] = None) -> Dict:
+async def get_status_summary(user_id: str, vendor_name: Optional[str] = None) -> Dict:
     """Get a quick summary of processing status (counts by status).
     Returns structure compatible with frontend InvoiceStatusSummaryResponse.
     """
     try:
-        db = get_db()
-        docs = db["documents"]
-        
-        query = {"userId": user_id}
-        if vendor_name:
-            query["vendorName"] = vendor_name
-        
-        # Count by ocrStatus
-        pipeline = [
-            {"$match": query},
-            {"$group": {"_id": "$ocrStatus", "count": {"$sum": 1}}}
-        ]
-        
-        status_counts = list(docs.aggregate(pipeline))
-        # Frontend expects 'by_status' not 'by_ocr_status'
-        by_status = {item["_id"] or "PENDING": item["count"] for item in status_counts}
+        docs = await _documents()
+        query = _status_query(user_id, vendor_name)
         
-        total = docs.count_documents(query)
+        # Count by ocrStatus; frontend expects 'by_status' not 'by_ocr_status'
+        by_status = await asyncio.to_thread(_count_by_status, docs, query)
+        # Every matching document lands in exactly one group, so no separate count query
+        total = sum(by_status.values())
         failed_count = by_status.get("FAILED", 0)
         
         return {
@@ -224,12 +354,13 @@ def get_status_summary(user_id: str, vendor_name: Optional[str] = None) -> Dict:
 
 
 def clear_user_documents(user_id: str) -> Dict:
-    """Delete all document records for a user from MongoDB."""
+    """Delete all document records (and mirrored master.json copies) for a user from MongoDB."""
     try:
         db = get_db()
         docs = db["documents"]
         
         result = docs.delete_many({"userId": user_id})
+        delete_master_mirrors(user_id)
         
         return {
             "success": True,
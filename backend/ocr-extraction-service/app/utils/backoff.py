@@ -0,0 +1,22 @@
+"""
+Backoff delays shared by the Gemini client and the Drive/OCR HTTP retries.
+"""
+import random
+from typing import Optional
+
+import httpx
+
+# Cap for a server-sent Retry-After and for the exponential term (before jitter)
+MAX_RETRY_DELAY_SECONDS = 60
+
+
+def retry_delay(retry_count: int, base_delay: float, response: Optional[httpx.Response] = None) -> float:
+    """Honor Retry-After (capped) when the server sends it, else capped exponential backoff with jitter."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(MAX_RETRY_DELAY_SECONDS, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+    return min(MAX_RETRY_DELAY_SECONDS, base_delay * (2 ** retry_count)) * (0.5 + random.random())